@@ -5,4 +5,5 @@ setup(
     version="1.0",
     packages=find_packages(where="src"),
     package_dir={"": "src"},
+    entry_points={"console_scripts": ["risq = risq.cli:main"]},
 )
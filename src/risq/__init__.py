@@ -1,26 +1,61 @@
-from risq.combined_model import CombinedModel
-from risq.method import Method
-from risq.model import Model, State
-from risq.models import create_six_mutations_model, create_two_state_model
-from risq.monte_carlo_method import MonteCarlo2D
-from risq.neighboring_cell_method import NeighboringCellMethod
-from risq.optimization import gradient_descent, steepest_descent
-from risq.single_cell_method import SingleCellMethod
-from risq.utils import compute_cancer_probability, plot_distributions, print_latex_table
-
-__all__ = [
-    "Model",
-    "State",
-    "Method",
-    "MonteCarlo2D",
-    "NeighboringCellMethod",
-    "SingleCellMethod",
-    "plot_distributions",
-    "CombinedModel",
-    "create_two_state_model",
-    "create_six_mutations_model",
-    "compute_cancer_probability",
-    "steepest_descent",
-    "gradient_descent",
-    "print_latex_table",
-]
+import importlib
+from typing import TYPE_CHECKING
+
+# The attributes of the package and the modules they are defined in. Modules are only
+# imported when one of their attributes is first used, so `import risq` is fast and
+# does not import matplotlib (or tqdm) unless plotting (or a progress bar) is needed.
+_ATTRIBUTES = {
+    "Model": "risq.model",
+    "State": "risq.model",
+    "Method": "risq.method",
+    "MonteCarlo2D": "risq.monte_carlo_method",
+    "NeighboringCellMethod": "risq.neighboring_cell_method",
+    "SingleCellMethod": "risq.single_cell_method",
+    "plot_distributions": "risq.plotting",
+    "CombinedModel": "risq.combined_model",
+    "create_two_state_model": "risq.models",
+    "create_k_mutations_model": "risq.models",
+    "create_six_mutations_model": "risq.models",
+    "compute_cancer_probability": "risq.utils",
+    "incidence_loss": "risq.utils",
+    "compute_probability_batch": "risq.batch",
+    "compute_loss_and_gradient": "risq.sensitivity",
+    "steepest_descent": "risq.optimization",
+    "gradient_descent": "risq.optimization",
+    "instrument": "risq.instrumentation",
+    "print_latex_table": "risq.plotting",
+}
+
+__all__ = list(_ATTRIBUTES)
+
+if TYPE_CHECKING:
+    from risq.batch import compute_probability_batch
+    from risq.combined_model import CombinedModel
+    from risq.instrumentation import instrument
+    from risq.method import Method
+    from risq.model import Model, State
+    from risq.models import (
+        create_k_mutations_model,
+        create_six_mutations_model,
+        create_two_state_model,
+    )
+    from risq.monte_carlo_method import MonteCarlo2D
+    from risq.neighboring_cell_method import NeighboringCellMethod
+    from risq.optimization import gradient_descent, steepest_descent
+    from risq.plotting import plot_distributions, print_latex_table
+    from risq.sensitivity import compute_loss_and_gradient
+    from risq.single_cell_method import SingleCellMethod
+    from risq.utils import compute_cancer_probability, incidence_loss
+
+
+def __getattr__(name: str):
+    if name not in _ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_ATTRIBUTES[name]), name)
+    globals()[name] = value  # only import once
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *__all__])
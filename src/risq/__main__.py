@@ -0,0 +1,5 @@
+import sys
+
+from risq.cli import main
+
+sys.exit(main())
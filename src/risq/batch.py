@@ -0,0 +1,110 @@
+from collections.abc import Callable
+
+import numpy as np
+
+from risq.method import Method
+from risq.model import Model, State
+from risq.neighboring_cell_method import NeighboringCellMethod, step_neighboring_cell
+from risq.single_cell_method import SingleCellMethod, step_single_cell
+
+
+def compute_probability_batch(
+    create_model: Callable[..., Model],
+    parameters: np.ndarray,
+    method: type[Method],
+    *,
+    times: list[int],
+    state: State,
+) -> np.ndarray:
+    """Computes the probability that a cell is in given state at given times, for many
+    parameter sets of the same model family at once.
+
+    All parameter sets are propagated together, with a leading batch axis, instead of
+    creating a separate `SingleCellMethod` or `NeighboringCellMethod` for each.
+
+    Args:
+        create_model: Function creating the model, e.g. `create_two_state_model`.
+        parameters: Array of shape `(num_parameter_sets, num_parameters)`. Each row is
+            passed to `create_model` as positional arguments.
+        method: Either `SingleCellMethod` or `NeighboringCellMethod`.
+        times: The times at which to return the probabilities.
+        state: The state of interest, e.g. the cancer state.
+
+    Returns:
+        An array of shape `(num_parameter_sets, len(times))`.
+    """
+    parameters = np.atleast_2d(parameters)
+    models = [create_model(*values) for values in parameters]
+
+    results = np.zeros((len(models), len(times)))
+    for i, (p, _) in enumerate(propagate_batch(models, method, times)):
+        results[:, i] = p[:, state].real
+    return results
+
+
+def propagate_batch(
+    models: list[Model], method: type[Method], times: list[int]
+) -> list[tuple[np.ndarray, np.ndarray | None]]:
+    """Propagates the probabilities of all states for many models at once.
+
+    Args:
+        models: The models, which should all have the same states.
+        method: Either `SingleCellMethod` or `NeighboringCellMethod`.
+        times: The times at which to return the probabilities.
+
+    Returns:
+        A list with for each time a tuple `(p, P)`, where `p[b, X]` is the probability
+        that a cell is in state `X` for model `b`. For `NeighboringCellMethod`,
+        `P[b, X, Y]` is the probability that neighboring cells are in states `(X, Y)`,
+        otherwise `P` is `None`.
+    """
+    compiled_models = [model.compile() for model in models]
+    lazy = any(compiled_model.lazy for compiled_model in compiled_models)
+    assert (
+        lazy
+        or len({compiled_model.num_pieces for compiled_model in compiled_models}) == 1
+    ), "All models should compile to the same number of pieces"
+
+    if not lazy:
+        probs_internal = np.stack([c.probs_internal for c in compiled_models])
+        probs_spread = np.stack([c.probs_spread for c in compiled_models])
+        batch = np.arange(len(models))
+
+    model = models[0]
+    p = np.array([model.prob_initial((X,)) for X in model.states])
+    p = np.broadcast_to(p, (len(models), model.num_states))
+    P = None
+    if method is NeighboringCellMethod:
+        P = np.array(
+            [[model.prob_initial((X, Y)) for Y in model.states] for X in model.states]
+        )
+        P = np.broadcast_to(P, (len(models), model.num_states, model.num_states))
+    elif method is not SingleCellMethod:
+        raise NotImplementedError(f"Batched evaluation is not supported for {method}")
+
+    results = [None] * len(times)
+    positions = {}
+    for i, time in enumerate(times):
+        positions.setdefault(time, []).append(i)
+
+    for t in range(max(times, default=0) + 1):
+        if t > 0:
+            if lazy:
+                tables = [c.tables(t) for c in compiled_models]
+                internal = np.stack([table[0] for table in tables])
+                spread = np.stack([table[1] for table in tables])
+            else:
+                indices = [c.index(t) for c in compiled_models]
+                internal = probs_internal[batch, indices]
+                spread = probs_spread[batch, indices]
+            if method is NeighboringCellMethod:
+                p, P = step_neighboring_cell(
+                    p, P, internal, spread, model.num_neighbors
+                )
+            else:
+                p = step_single_cell(p, internal, spread, model.num_neighbors)
+
+        for i in positions.get(t, []):
+            results[i] = (p, P)
+
+    return results
@@ -0,0 +1,372 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+
+import numpy as np
+
+from risq.method import Method
+from risq.model import Model
+from risq.models import create_six_mutations_model, create_two_state_model
+from risq.monte_carlo_method import MonteCarlo2D
+from risq.neighboring_cell_method import NeighboringCellMethod
+from risq.optimization import steepest_descent
+from risq.single_cell_method import SingleCellMethod
+from risq.utils import incidence_loss
+
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2  # relative slowdown that counts as a regression
+
+# Modules that `import risq` should not import, as they are slow to import
+LAZY_MODULES = ["matplotlib", "tqdm", "risq.plotting", "risq.monte_carlo_method"]
+
+# Seconds that `import risq` may take, as reported by `python -X importtime`. Importing
+# NumPy alone takes longer, and matplotlib several times longer.
+IMPORT_BUDGET = 0.1
+
+MODELS: dict[str, Callable[[], Model]] = {
+    "two-state": lambda: create_two_state_model(prob_mutate=0.001, prob_spread=0.01),
+    "six-mutations": lambda: create_six_mutations_model(
+        prob_mutate=0.020360638820134225,
+        prob_dying=0.5647743182095744,
+        prob_spread=0.01593379960021246,
+    ),
+}
+
+
+def create_benchmarks(quick: bool = False) -> dict[str, Callable[[], None]]:
+    """Creates the benchmarks, as functions doing all the work to be timed.
+
+    Args:
+        quick: Whether to only use short time horizons and small lattices.
+    """
+    benchmarks = {"import risq": _import()}
+    horizons = [20, 200] if quick else [20, 200, 1000]
+
+    # Deterministic methods, without caches so every run does the same work
+    for model_name, create_model in MODELS.items():
+        for time_steps in horizons:
+            for method in (SingleCellMethod, NeighboringCellMethod):
+                name = f"{method.__name__}/{model_name}/T={time_steps}"
+                benchmarks[name] = _deterministic(method, create_model, time_steps)
+
+    # Monte Carlo, for the different engines
+    lattices = [
+        ("cell", 8, 2, 20),
+        ("lattice", 32, 20, 50),
+        ("sparse", 128, 1, 50),
+    ]
+    if not quick:
+        lattices += [
+            ("cell", 16, 4, 50),
+            ("lattice", 32, 100, 100),
+            ("lattice", 128, 10, 100),
+            ("lattice", 64, 10, 1000),
+            ("lattice", 1000, 1, 20),
+            ("sparse", 1000, 1, 20),
+        ]
+    for model_name, create_model in MODELS.items():
+        for engine, size, num_trials, time_steps in lattices:
+            name = (
+                f"MonteCarlo2D[{engine}]/{model_name}/"
+                f"{size}x{size}/trials={num_trials}/T={time_steps}"
+            )
+            benchmarks[name] = _monte_carlo(
+                create_model, engine, size, num_trials, time_steps
+            )
+
+    # The sparse engine when (almost) all cells leave state 0 in a single time step
+    for prob_mutate in (0.999, 1.0):
+        name = f"MonteCarlo2D[sparse]/two-state/p={prob_mutate}/300x300/T=2"
+        benchmarks[name] = _sparse_leaving(prob_mutate)
+
+    # A few iterations of fitting the two state model
+    benchmarks["steepest_descent/two-state"] = _fit(num_iter=2 if quick else 5)
+
+    return benchmarks
+
+
+def run_benchmarks(
+    benchmarks: dict[str, Callable[[], None]],
+    repeat: int = DEFAULT_REPEAT,
+    verbose: bool = True,
+) -> dict:
+    """Runs every benchmark `repeat` times, and returns the timings (in seconds)
+    together with a description of the environment."""
+    results = {}
+    for name, benchmark in benchmarks.items():
+        timings = []
+        for _ in range(repeat):
+            # Silence progress bars and printed results
+            with contextlib.redirect_stdout(io.StringIO()):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    start = time.perf_counter()
+                    benchmark()
+                    timings.append(time.perf_counter() - start)
+
+        results[name] = {
+            "best": min(timings),
+            "mean": sum(timings) / len(timings),
+            "repeat": repeat,
+        }
+        if verbose:
+            print(f"{name:<60} {min(timings):10.4f} s", flush=True)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> list[str]:
+    """Prints the timings of `results` relative to `baseline`, and returns the names
+    of the benchmarks that are slower by more than `tolerance` (e.g. 0.2 = 20%)."""
+    regressions = []
+    print(f"{'benchmark':<60} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        best = result["best"]
+        best_baseline = baseline["results"][name]["best"]
+        ratio = best / best_baseline if best_baseline > 0 else float("inf")
+        flag = ""
+        if ratio > 1.0 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<60} {best_baseline:10.4f} {best:10.4f} {ratio:7.2f}{flag}")
+
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m risq.bench",
+        description="Times the methods of risq, optionally against a baseline.",
+    )
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("-b", "--baseline", help="compare with this JSON file")
+    parser.add_argument(
+        "-k", "--filter", help="only run benchmarks matching this regular expression"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=DEFAULT_REPEAT, help="runs per benchmark"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="relative slowdown that counts as a regression (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-q", "--quick", action="store_true", help="only run the small benchmarks"
+    )
+    parser.add_argument(
+        "-l", "--list", action="store_true", help="list the benchmarks and exit"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check that `import risq` is lazy and within its time budget",
+    )
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = check_import()
+        print("\n".join(problems) or "import risq is within its budget")
+        return 1 if problems else 0
+
+    benchmarks = create_benchmarks(quick=args.quick)
+    if args.filter:
+        pattern = re.compile(args.filter)
+        benchmarks = {
+            name: benchmark
+            for name, benchmark in benchmarks.items()
+            if pattern.search(name)
+        }
+    if args.list:
+        print("\n".join(benchmarks))
+        return 0
+
+    results = run_benchmarks(benchmarks, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print()
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed")
+            return 1
+
+    return 0
+
+
+def check_import(budget: float = IMPORT_BUDGET, repeat: int = 3) -> list[str]:
+    """Imports risq in new interpreters, and returns the problems found: modules of
+    `LAZY_MODULES` that were imported anyway, and an import time over `budget` seconds
+    (the best of `repeat` imports, as reported by `python -X importtime`)."""
+    script = (
+        "import sys, risq\n"
+        f"print([m for m in {LAZY_MODULES!r} if m in sys.modules])\n"
+    )
+    timings = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # Lines read "import time: <self> | <cumulative> | <module>", in microseconds
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, module = line.rsplit("|", 2)
+            if module.strip() == "risq":
+                timings.append(int(cumulative) / 1e6)
+
+    problems = []
+    eager = process.stdout.strip()
+    if eager != "[]":
+        problems.append(f"import risq imported {eager}")
+    if min(timings) > budget:
+        problems.append(
+            f"import risq took {min(timings):.3f} s, over its budget of {budget} s"
+        )
+    return problems
+
+
+def _import() -> Callable[[], None]:
+    # Import in a new interpreter, failing if a lazy module was imported anyway
+    script = (
+        "import sys, risq\n"
+        f"eager = [m for m in {LAZY_MODULES!r} if m in sys.modules]\n"
+        "sys.exit(f'import risq imported {eager}' if eager else 0)\n"
+    )
+
+    def benchmark():
+        subprocess.run([sys.executable, "-c", script], check=True)
+
+    return benchmark
+
+
+def _deterministic(
+    method: type[Method], create_model: Callable[[], Model], time_steps: int
+) -> Callable[[], None]:
+    def benchmark():
+        simulation = method(create_model(), prefix_cache=None)
+        for state in simulation.model.states:
+            simulation.probability(time_steps, state)
+            simulation.variance(time_steps, state)
+
+    return benchmark
+
+
+def _monte_carlo(
+    create_model: Callable[[], Model],
+    engine: str,
+    size: int,
+    num_trials: int,
+    time_steps: int,
+) -> Callable[[], None]:
+    def benchmark():
+        simulation = MonteCarlo2D(
+            create_model(),
+            num_trials=num_trials,
+            width=size,
+            height=size,
+            time_steps=time_steps,
+            seed=0,
+            engine=engine,
+        )
+        simulation.simulate()
+
+    return benchmark
+
+
+def _sparse_leaving(prob_mutate: float) -> Callable[[], None]:
+    # Without spreading, every cell mutates independently
+    model = create_two_state_model(prob_mutate=prob_mutate, prob_spread=0.0)
+
+    def benchmark():
+        simulation = MonteCarlo2D(
+            model,
+            num_trials=1,
+            width=300,
+            height=300,
+            time_steps=2,
+            seed=0,
+            engine="sparse",
+        )
+        probability = simulation.probability(1, 1)
+        assert abs(probability - prob_mutate) < 0.01, probability
+
+    return benchmark
+
+
+FIT_AGES = list(range(5, 100, 5))
+FIT_TARGET = {"log_prob_mutate": -6.5, "log_prob_spread": -3.0}  # known parameters
+FIT_START = {"log_prob_mutate": -6.0, "log_prob_spread": -2.5}
+
+
+def _fit(num_iter: int) -> Callable[[], None]:
+    def benchmark():
+        values = steepest_descent(_fit_loss, FIT_START, num_iter=num_iter, delta=0.1)
+
+        # Make sure the benchmark times a fit that makes progress
+        assert _fit_loss(**values) < _fit_loss(**FIT_START), "Fit made no progress"
+
+    return benchmark
+
+
+def _fit_simulation(log_prob_mutate: float, log_prob_spread: float) -> Method:
+    model = create_two_state_model(
+        prob_mutate=10.0**log_prob_mutate, prob_spread=10.0**log_prob_spread
+    )
+    return SingleCellMethod(model, prefix_cache=None)
+
+
+@functools.cache
+def _fit_distribution() -> list[tuple[int, float]]:
+    # Incidence of the two state model with the known parameters
+    simulation = _fit_simulation(**FIT_TARGET)
+    _, _, prob_cdf = simulation.incidence_curve(
+        [age * 12 for age in FIT_AGES], 1, num_cells=1000
+    )
+    return list(zip(FIT_AGES, np.diff(prob_cdf, prepend=0.0).tolist()))
+
+
+def _fit_loss(
+    log_prob_mutate: float, log_prob_spread: float, cutoff: float | None = None
+) -> float:
+    # Square difference with the incidence of the known parameters (minimal there)
+    return incidence_loss(
+        _fit_simulation(log_prob_mutate, log_prob_spread),
+        _fit_distribution(),
+        num_cells=1000,
+        state_cancer=1,
+        cutoff=cutoff,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
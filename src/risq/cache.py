@@ -0,0 +1,250 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from risq.compiled_model import CompiledModel
+
+
+class ResultCache:
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 2**30) -> None:
+        """On-disk cache of simulation results, such as trajectories and Monte Carlo
+        statistics, stored as memory-mappable NumPy files.
+
+        Each entry is a directory named after its key, containing one `.npy` file per
+        array. When the cache grows beyond `max_bytes`, the least recently used entries
+        are removed.
+
+        Args:
+            directory: The directory to store the cache in.
+            max_bytes: The maximum total size of the cache in bytes.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Computes a key by hashing `parts`, which may contain NumPy arrays."""
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                h.update(f"{part.dtype}{part.shape}".encode())
+                h.update(np.ascontiguousarray(part).tobytes())
+            else:
+                h.update(repr(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def load(self, key: str) -> dict[str, np.ndarray] | None:
+        """Returns the (memory-mapped) arrays stored under given key, if any."""
+        path = self.directory / key
+        if not path.is_dir():
+            return None
+
+        try:
+            arrays = {
+                file.stem: np.load(file, mmap_mode="r") for file in path.glob("*.npy")
+            }
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None  # e.g. removed by another process in the meantime
+
+        return arrays
+
+    def store(self, key: str, arrays: dict[str, np.ndarray]):
+        """Stores arrays under given key, replacing any previous entry."""
+        # Write to a temporary directory first, so other processes never see partial entries
+        tmp = Path(tempfile.mkdtemp(dir=self.directory, prefix=".tmp-"))
+        for name, array in arrays.items():
+            np.save(tmp / f"{name}.npy", array)
+
+        path = self.directory / key
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # stored by another process
+
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for path in self.directory.iterdir():
+            if not path.is_dir() or path.name.startswith("."):
+                continue
+            try:
+                size = sum(file.stat().st_size for file in path.iterdir())
+                entries.append((path.stat().st_mtime, size, path))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Removes all entries."""
+        for path in self.directory.iterdir():
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class PrefixCache:
+
+    def __init__(self, max_bytes: int = 2**28) -> None:
+        """In-memory cache of trajectory prefixes, shared between methods.
+
+        Entries are keyed by `PrefixKeys`, which identify the initial state and the
+        transition tables used at every time step up to some time. Methods store their
+        trajectory at every switch of the schedule, so when e.g. a `CombinedModel`
+        shares its default model with earlier evaluations, only the time steps after
+        the first difference are computed again. Models that share no prefixes (such
+        as plain models with other parameters) do not benefit, so methods only use a
+        prefix cache when given one.
+
+        Args:
+            max_bytes: The maximum total size of the arrays of all prefixes (counting
+                arrays shared between prefixes once per prefix). When exceeded, the
+                least recently used prefixes are removed.
+        """
+        self.max_bytes = max_bytes
+
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._total = 0
+
+    def load(self, keys: list[str], start: int) -> tuple[int, tuple] | None:
+        """Returns `(time, value)` for the latest time (not before `start`) for which
+        the prefix with key `keys[time]` is cached, if any."""
+        for time in range(len(keys) - 1, start - 1, -1):
+            value = self._entries.get(keys[time])
+            if value is not None:
+                self._entries.move_to_end(keys[time])  # mark as recently used
+                return time, value
+        return None
+
+    def store(self, key: str, value: tuple):
+        """Stores a prefix (a tuple of trajectories, i.e. sequences of arrays) under
+        given key, unless it is larger than `max_bytes` by itself."""
+        size = sum(array.nbytes for trajectory in value for array in trajectory)
+        if size > self.max_bytes:
+            return
+
+        self._total += size - self._sizes.get(key, 0)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._entries.move_to_end(key)
+        while self._total > self.max_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self._total -= self._sizes.pop(old_key)
+
+    def clear(self):
+        """Removes all prefixes."""
+        self._entries.clear()
+        self._sizes.clear()
+        self._total = 0
+
+
+DEFAULT_PREFIX_CACHE = PrefixCache()  # to share between methods, when enabled
+
+
+class PrefixKeys:
+
+    def __init__(self, compiled_model: CompiledModel, *parts) -> None:
+        """Keys of the prefixes of the trajectory of a compiled model, for use with
+        `PrefixCache`.
+
+        The key of time `t` is a rolling hash over the tables of the pieces used at
+        times 1, ..., `t`, so two models get the same key at time `t` exactly when
+        they use the same tables up to that time (regardless of how those tables are
+        split into pieces).
+
+        Args:
+            compiled_model: The compiled model.
+            parts: Anything else the trajectory depends on (e.g. the method and the
+                initial state), which determines the key at time 0.
+        """
+        self.compiled_model = compiled_model
+
+        self._pieces: dict[int, str] = {}  # keys of the pieces, by index
+        self._keys = [ResultCache.key(*parts)]
+
+    def until(self, time: int) -> list[str]:
+        """The keys of times 0, ..., `time` (and possibly later)."""
+        while len(self._keys) <= time:
+            t = len(self._keys)
+            k = self.compiled_model.index(t)
+            if k not in self._pieces:
+                self._pieces[k] = ResultCache.key(*self.compiled_model.tables(t))
+            piece = self._pieces[k]
+            self._keys.append(ResultCache.key(self._keys[-1], piece))
+        return self._keys
+
+    def is_boundary(self, time: int) -> bool:
+        """Whether the schedule switches to another piece after given time."""
+        return self.compiled_model.index(time) != self.compiled_model.index(time + 1)
+
+
+def model_key(compiled_model: CompiledModel, num_neighbors: int) -> tuple:
+    """The parts of a cache key that identify a (compiled) model.
+
+    The schedule of the model is not included, since it may be evaluated lazily.
+    Use `schedule_prefix` to check up to which time a cached result is valid."""
+    return (
+        compiled_model.probs_internal,
+        compiled_model.probs_spread,
+        num_neighbors,
+    )
+
+
+def schedule_indices(compiled_model: CompiledModel, time_steps: int) -> np.ndarray:
+    """The index of the piece of the schedule used at times 1, ..., `time_steps`."""
+    return np.array(
+        [compiled_model.index(t) for t in range(1, time_steps + 1)], dtype=np.int64
+    )
+
+
+def schedule_prefix(compiled_model: CompiledModel, indices: np.ndarray) -> int:
+    """The last time up to which `compiled_model` follows the schedule `indices`."""
+    for t, index in enumerate(indices, start=1):
+        if compiled_model.index(t) != index:
+            return t - 1
+    return len(indices)
+
+
+def load_trajectories(
+    cache: ResultCache, key: str, compiled_model: CompiledModel
+) -> dict[str, np.ndarray] | None:
+    """Loads trajectories (arrays indexed by time) stored by `store_trajectories`,
+    truncated to the times for which `compiled_model` follows the cached schedule."""
+    arrays = cache.load(key)
+    if arrays is None:
+        return None
+
+    end = schedule_prefix(compiled_model, arrays.pop("schedule"))
+    return {name: array[: end + 1] for name, array in arrays.items()}
+
+
+def store_trajectories(
+    cache: ResultCache,
+    key: str,
+    compiled_model: CompiledModel,
+    arrays: dict[str, np.ndarray],
+):
+    """Stores trajectories (arrays indexed by time, starting at time 0), together
+    with the schedule of `compiled_model` they were computed with."""
+    time_steps = len(next(iter(arrays.values()))) - 1
+    cache.store(
+        key, {**arrays, "schedule": schedule_indices(compiled_model, time_steps)}
+    )
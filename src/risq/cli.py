@@ -0,0 +1,438 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import queue
+import sys
+import time
+import traceback
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO
+
+import numpy as np
+
+from risq.cache import DEFAULT_PREFIX_CACHE
+from risq.combined_model import CombinedModel
+from risq.method import Method
+from risq.model import Model
+from risq.models import (
+    create_k_mutations_model,
+    create_six_mutations_model,
+    create_two_state_model,
+)
+from risq.monte_carlo_method import MonteCarlo2D
+from risq.neighboring_cell_method import NeighboringCellMethod
+from risq.optimization import gradient_descent, steepest_descent
+from risq.single_cell_method import SingleCellMethod
+from risq.utils import incidence_loss
+
+MODEL_FAMILIES: dict[str, Callable[..., Model]] = {
+    "two_state": create_two_state_model,
+    "six_mutations": create_six_mutations_model,
+    "k_mutations": create_k_mutations_model,
+}
+
+METHODS: dict[str, type[Method]] = {
+    "SingleCellMethod": SingleCellMethod,
+    "NeighboringCellMethod": NeighboringCellMethod,
+    "MonteCarlo2D": MonteCarlo2D,
+}
+
+OPTIMIZERS: dict[str, Callable] = {
+    "steepest_descent": steepest_descent,
+    "gradient_descent": gradient_descent,
+}
+
+TRANSFORMS: dict[str, Callable[[float], float]] = {
+    "erf": lambda x: (1.0 + math.erf(x)) / 2.0,  # as in the notebooks
+    "none": lambda x: x,
+}
+
+# Seconds to wait for the last records of the workers, after all starts are done
+RECORD_TIMEOUT = 10.0
+
+EXAMPLE_CONFIG = """\
+# Fits the six mutations model to the control group (see the notebooks)
+
+[model]
+family = "six_mutations"          # two_state, six_mutations or k_mutations
+fixed = {}                        # fixed arguments of the model, e.g. { k = 6 }
+transform = "erf"                 # parameters are optimized as (1 + erf(x)) / 2
+
+# Random starts are drawn uniformly from these ranges (before the transform)
+[model.parameters]
+prob_mutate = [-1.6, -1.2]
+prob_dying = [-0.2, 0.4]
+prob_spread = [-1.8, -1.4]
+
+# Optional: only use the fitted model in the time steps [start, stop), and a model
+# with fixed parameters otherwise
+# [model.combined]
+# start = 360
+# stop = 366
+# default = { prob_mutate = 0.0204, prob_dying = 0.5648, prob_spread = 0.0159 }
+
+[distribution]
+ages = [22, 27, 32, 37, 42, 47, 52, 57, 62, 67, 72, 77, 82, 87]
+cases = [5, 10, 25, 80, 180, 260, 250, 230, 245, 255, 240, 215, 175, 120]
+population = 100_000              # cases are per this many people
+lag = 5                           # years subtracted from the ages
+steps_per_year = 12               # 1 time step = 1 month
+num_cells = 1_000_000
+state_cancer = 7                  # C
+
+[method]
+name = "NeighboringCellMethod"    # SingleCellMethod, NeighboringCellMethod or MonteCarlo2D
+options = {}                      # further arguments of the method
+prefix_cache = false              # share prefixes between evaluations (for [model.combined])
+
+[optimizer]
+name = "steepest_descent"         # steepest_descent or gradient_descent
+options = { num_iter = 50, delta = 0.01 }
+
+[fit]
+num_starts = 8
+num_workers = 4
+seed = 0
+output = "fit.jsonl"
+"""
+
+
+class TimeWindow:
+
+    def __init__(self, start: int, stop: int) -> None:
+        """The condition `start <= time < stop`, as used by `CombinedModel` (unlike a
+        lambda, this can be sent to worker processes)."""
+        self.start = start
+        self.stop = stop
+
+    def __call__(self, time: int) -> bool:
+        return self.start <= time < self.stop
+
+
+class FitLoss:
+
+    def __init__(self, config: dict) -> None:
+        """The loss of a config, as a function of the (transformed) parameters of the
+        model: the total square difference between the incidence per age group of the
+        model and that of the distribution, as in the notebooks. Supports stopping
+        early, with `cutoff` (see `incidence_loss`)."""
+        self.config = config
+
+    def probabilities(self, values: dict[str, float]) -> dict[str, float]:
+        """The parameters of the model, from the values the optimizer works with."""
+        transform = TRANSFORMS[self.config["model"].get("transform", "erf")]
+        return {x: transform(value) for x, value in values.items()}
+
+    def create_model(self, values: dict[str, float]) -> Model:
+        config = self.config["model"]
+        create = MODEL_FAMILIES[config["family"]]
+        fixed = config.get("fixed", {})
+        model = create(**fixed, **self.probabilities(values))
+
+        combined = config.get("combined")
+        if combined is not None:
+            model_default = create(**fixed, **combined["default"])
+            model = CombinedModel(
+                model_default,
+                model,
+                TimeWindow(combined["start"], combined["stop"]),
+            )
+
+        return model
+
+    def __call__(self, *, cutoff: float | None = None, **values: float) -> float:
+        config = self.config["method"]
+        method = METHODS[config["name"]]
+        options = dict(config.get("options", {}))
+        if config.get("prefix_cache", False):
+            options["prefix_cache"] = DEFAULT_PREFIX_CACHE
+        simulation = method(self.create_model(values), **options)
+
+        config = self.config["distribution"]
+        population = config.get("population", 1)
+        lag = config.get("lag", 0)
+        distribution = [
+            (age - lag, cases / population)
+            for age, cases in zip(config["ages"], config["cases"])
+        ]
+
+        return incidence_loss(
+            simulation,
+            distribution,
+            num_cells=config["num_cells"],
+            state_cancer=config["state_cancer"],
+            steps_per_year=config.get("steps_per_year", 12),
+            cutoff=cutoff,
+        )
+
+
+def load_config(path: str) -> dict:
+    """Reads a config from a TOML file, or from a JSON file (ending in `.json`)."""
+    if path.endswith(".json"):
+        with open(path) as file:
+            config = json.load(file)
+    else:
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            raise RuntimeError(
+                "Reading TOML requires Python 3.11 or newer, use a JSON config instead"
+            )
+        with open(path, "rb") as file:
+            config = tomllib.load(file)
+
+    check_config(config)
+    return config
+
+
+def check_config(config: dict):
+    """Raises a `ValueError` if a config misses sections or names unknown things."""
+    for section in ("model", "distribution", "method", "optimizer"):
+        if section not in config:
+            raise ValueError(f"Config misses section [{section}]")
+
+    model = config["model"]
+    if model.get("family") not in MODEL_FAMILIES:
+        raise ValueError(
+            f"Unknown model family {model.get('family')!r}, "
+            f"expected one of {', '.join(MODEL_FAMILIES)}"
+        )
+    if model.get("transform", "erf") not in TRANSFORMS:
+        raise ValueError(f"Unknown transform {model['transform']!r}")
+    if not model.get("parameters"):
+        raise ValueError("Config misses the parameters to fit, [model.parameters]")
+    for x, bounds in model["parameters"].items():
+        if not (isinstance(bounds, list) and len(bounds) == 2):
+            raise ValueError(f"Range of parameter {x!r} should be [lower, upper]")
+
+    distribution = config["distribution"]
+    for key in ("ages", "cases", "num_cells", "state_cancer"):
+        if key not in distribution:
+            raise ValueError(f"Config misses {key!r} in [distribution]")
+    if len(distribution["ages"]) != len(distribution["cases"]):
+        raise ValueError("Ages and cases of the distribution differ in length")
+
+    if config["method"].get("name") not in METHODS:
+        raise ValueError(
+            f"Unknown method {config['method'].get('name')!r}, "
+            f"expected one of {', '.join(METHODS)}"
+        )
+    if config["optimizer"].get("name") not in OPTIMIZERS:
+        raise ValueError(
+            f"Unknown optimizer {config['optimizer'].get('name')!r}, "
+            f"expected one of {', '.join(OPTIMIZERS)}"
+        )
+
+
+def draw_starts(config: dict, num_starts: int, seed: int | None) -> list[dict]:
+    """Draws the initial values of the starts uniformly from the parameter ranges.
+    The starts only depend on the seed, not on the number of workers."""
+    random_state = np.random.RandomState(seed)
+    parameters = config["model"]["parameters"]
+    return [
+        {
+            x: float(random_state.uniform(lower, upper))
+            for x, (lower, upper) in parameters.items()
+        }
+        for _ in range(num_starts)
+    ]
+
+
+def run_start(
+    config: dict, start: int, values: dict[str, float], emit: Callable[[dict], None]
+):
+    """Runs the optimizer from one start, passing a record to `emit` when the start
+    begins, after every iteration, and with the final (or failed) result."""
+    loss_function = FitLoss(config)
+    optimizer = OPTIMIZERS[config["optimizer"]["name"]]
+    options = config["optimizer"].get("options", {})
+
+    def callback(iteration: int, loss: float, values: dict[str, float]):
+        emit(
+            {
+                "start": start,
+                "event": "iteration",
+                "iteration": iteration,
+                "loss": loss,
+                "values": values,
+            }
+        )
+
+    emit({"start": start, "event": "start", "values": values})
+    begin = time.perf_counter()
+    try:
+        # Silence the progress bars and printed results of the optimizer
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.redirect_stderr(io.StringIO()):
+                values = optimizer(loss_function, values, callback=callback, **options)
+                loss = loss_function(**values)
+    except Exception as error:
+        emit(
+            {
+                "start": start,
+                "event": "error",
+                "error": repr(error),
+                "traceback": traceback.format_exc(),
+            }
+        )
+        return
+
+    emit(
+        {
+            "start": start,
+            "event": "final",
+            "loss": loss,
+            "values": values,
+            "parameters": loss_function.probabilities(values),
+            "seconds": time.perf_counter() - begin,
+        }
+    )
+
+
+def fit(
+    config: dict,
+    output: IO[str],
+    *,
+    num_starts: int = 1,
+    num_workers: int = 1,
+    seed: int | None = None,
+    verbose: bool = True,
+) -> list[dict]:
+    """Runs the optimizer of a config from `num_starts` random starts, spread over
+    `num_workers` processes, and writes the progress of every start to `output` as
+    JSON lines (flushed as they arrive). Returns the final records, best first."""
+    starts = draw_starts(config, num_starts, seed)
+    finals = []
+
+    def write(record: dict):
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        if record["event"] in ("final", "error"):
+            finals.append(record)
+            if verbose:
+                if record["event"] == "final":
+                    print(f"start {record['start']:>4}: loss = {record['loss']:.6e}")
+                else:
+                    print(f"start {record['start']:>4}: failed with {record['error']}")
+
+    if num_workers <= 1:
+        for start, values in enumerate(starts):
+            run_start(config, start, values, write)
+    else:
+        records = multiprocessing.Queue()
+        with ProcessPoolExecutor(
+            num_workers, initializer=_init_worker, initargs=(records,)
+        ) as executor:
+            futures = [
+                executor.submit(_run_start_worker, config, start, values)
+                for start, values in enumerate(starts)
+            ]
+
+            # Write the records while the starts are running. Records are sent by a
+            # feeder thread of every worker, so the last ones can still be on their
+            # way when the futures are done: wait for those a while longer
+            deadline = None
+            while len(finals) < num_starts:
+                try:
+                    write(records.get(timeout=0.1))
+                except queue.Empty:
+                    if deadline is None:
+                        if all(future.done() for future in futures):
+                            for future in futures:
+                                future.result()  # raises if a worker broke down
+                            deadline = time.monotonic() + RECORD_TIMEOUT
+                    elif time.monotonic() > deadline:
+                        raise RuntimeError(
+                            f"The final records of {num_starts - len(finals)} "
+                            "start(s) were lost"
+                        )
+
+    return sorted(finals, key=lambda record: record.get("loss", math.inf))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="risq",
+        description="Fits the models of risq without the notebooks.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_fit = commands.add_parser(
+        "fit",
+        help="fit a model from many random starts in parallel",
+        description=(
+            "Fits the model of a config file (TOML or JSON) to an incidence "
+            "distribution from many random starts, and streams the progress and "
+            "final loss of every start to a JSON lines file."
+        ),
+    )
+    parser_fit.add_argument("config", help="the config file")
+    parser_fit.add_argument(
+        "-o", "--output", help="the JSON lines file to write (default: from config)"
+    )
+    parser_fit.add_argument("-n", "--num-starts", type=int, help="number of starts")
+    parser_fit.add_argument(
+        "-w", "--num-workers", type=int, help="number of worker processes"
+    )
+    parser_fit.add_argument("-s", "--seed", type=int, help="seed of the starts")
+
+    commands.add_parser("example", help="print an example config")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "example":
+        print(EXAMPLE_CONFIG, end="")
+        return 0
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, RuntimeError) as error:
+        print(f"risq: {error}", file=sys.stderr)
+        return 2
+
+    settings = config.get("fit", {})
+    output = args.output or settings.get("output", "fit.jsonl")
+    num_starts = args.num_starts or settings.get("num_starts", 1)
+    num_workers = args.num_workers or settings.get("num_workers", 1)
+    seed = args.seed if args.seed is not None else settings.get("seed")
+
+    with open(output, "w") as file:
+        finals = fit(
+            config,
+            file,
+            num_starts=num_starts,
+            num_workers=num_workers,
+            seed=seed,
+        )
+
+    best = finals[0] if finals else None
+    if best is None or best["event"] != "final":
+        print("risq: all starts failed", file=sys.stderr)
+        return 1
+
+    print()
+    print(f"best start {best['start']}: loss = {best['loss']:.6e}")
+    for x, value in best["parameters"].items():
+        print(f"  {x} = {value}")
+
+    return 0
+
+
+_records = None  # queue of the records, in worker processes
+
+
+def _init_worker(records: multiprocessing.Queue):
+    global _records
+    _records = records
+
+
+def _run_start_worker(config: dict, start: int, values: dict[str, float]):
+    run_start(config, start, values, _records.put)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
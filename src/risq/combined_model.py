@@ -1,5 +1,8 @@
 from collections.abc import Callable
 
+import numpy as np
+
+from risq.compiled_model import CompiledModel, LazyCompiledModel
 from risq.model import Model, State
 
 
@@ -38,6 +41,30 @@ class CombinedModel(Model):
         """Probability that a cell in state `attacker` overgrows a neighboring cell in state `target`."""
         return self._get_model(time).prob_spread(time, attacker, target)
 
+    def compile(self) -> CompiledModel:
+        """Compiles both models into a single schedule, where the pieces of the
+        special model follow those of the default model (or tabulates them lazily,
+        if either model is tabulated lazily)."""
+        default = self.model_default.compile()
+        special = self.model_special.compile()
+        if default.lazy or special.lazy:
+            return LazyCompiledModel(
+                lambda time: (
+                    special if self.special_condition(time) else default
+                ).tables(time)
+            )
+
+        def schedule(time: int) -> int:
+            if self.special_condition(time):
+                return default.num_pieces + special.index(time)
+            return default.index(time)
+
+        return CompiledModel(
+            np.concatenate([default.probs_internal, special.probs_internal]),
+            np.concatenate([default.probs_spread, special.probs_spread]),
+            schedule,
+        )
+
     @property
     def states(self) -> list[State]:
         return self.model_default.states
@@ -0,0 +1,128 @@
+from collections.abc import Callable
+
+import numpy as np
+
+
+class CompiledModel:
+
+    def __init__(
+        self,
+        probs_internal: np.ndarray,
+        probs_spread: np.ndarray,
+        schedule: Callable[[int], int] | None = None,
+    ) -> None:
+        """Dense transition tables of a model, as a piecewise schedule over time.
+
+        Args:
+            probs_internal: Array of shape `(num_pieces, num_states, num_states)` with
+                the internal transition probabilities of each piece of the schedule.
+                E.g. `probs_internal[k][i][j]` is the probability a cell in state `j`
+                transitions to state `i` when piece `k` is active.
+            probs_spread: Array of the same shape with the spreading probabilities.
+                E.g. `probs_spread[k][i][j]` is the probability a cell in state `j` is
+                overgrown by a neighboring cell in state `i` when piece `k` is active.
+            schedule: Maps a time to the index of the piece used going from `time - 1`
+                to `time`. It is evaluated at most once per time. If not given, the
+                first piece is used at all times.
+        """
+        self.probs_internal = probs_internal
+        self.probs_spread = probs_spread
+        self.schedule = schedule
+
+        self._indices: dict[int, int] = {}
+
+    # Whether the tables are only known up to the times used so far, see
+    # `LazyCompiledModel`
+    lazy = False
+
+    @property
+    def num_pieces(self) -> int:
+        return self.probs_internal.shape[0]
+
+    @property
+    def num_states(self) -> int:
+        return self.probs_internal.shape[-1]
+
+    @property
+    def support_internal(self) -> np.ndarray:
+        """Boolean mask of the internal transitions that are possible in some piece,
+        e.g. `support_internal[i][j]` is whether a cell in state `j` can transition to
+        state `i`. Transition matrices of models with many states are mostly zero."""
+        return (self.probs_internal != 0).any(axis=0)
+
+    def index(self, time: int) -> int:
+        """The index of the piece of the schedule that is used at given time."""
+        if self.schedule is None:
+            return 0
+
+        if time not in self._indices:
+            self._indices[time] = self.schedule(time)
+        return self._indices[time]
+
+    def tables(self, time: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the internal and spreading probabilities used at given time."""
+        k = self.index(time)
+        return self.probs_internal[k], self.probs_spread[k]
+
+    def tables_until(self, time_steps: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the internal and spreading probabilities for times 1, ..., `time_steps`,
+        as two arrays of shape `(time_steps, num_states, num_states)`."""
+        indices = [self.index(t) for t in range(1, time_steps + 1)]
+        return self.probs_internal[indices], self.probs_spread[indices]
+
+
+class LazyCompiledModel(CompiledModel):
+
+    def __init__(
+        self, tabulate: Callable[[int], tuple[np.ndarray, np.ndarray]]
+    ) -> None:
+        """Transition tables of a model that are tabulated at every time on first use,
+        for models whose probabilities are only given as functions of time.
+
+        Consecutive times with the same tables share a piece of the schedule, so
+        `probs_internal` and `probs_spread` only hold the pieces used so far.
+
+        Args:
+            tabulate: Maps a time to the internal and spreading probabilities used
+                going from `time - 1` to `time`, as two arrays of shape
+                `(num_states, num_states)`.
+        """
+        self.tabulate = tabulate
+        self.schedule = self._tabulate
+
+        self._indices: dict[int, int] = {}
+        self._internal: list[np.ndarray] = []
+        self._spread: list[np.ndarray] = []
+
+    lazy = True
+
+    @property
+    def probs_internal(self) -> np.ndarray:
+        return np.array(self._internal)
+
+    @property
+    def probs_spread(self) -> np.ndarray:
+        return np.array(self._spread)
+
+    @property
+    def num_pieces(self) -> int:
+        return len(self._internal)
+
+    @property
+    def num_states(self) -> int:
+        return self.tables(1)[0].shape[-1]
+
+    def tables(self, time: int) -> tuple[np.ndarray, np.ndarray]:
+        k = self.index(time)
+        return self._internal[k], self._spread[k]
+
+    def _tabulate(self, time: int) -> int:
+        internal, spread = self.tabulate(time)
+        if not (
+            self._internal
+            and np.array_equal(internal, self._internal[-1])
+            and np.array_equal(spread, self._spread[-1])
+        ):
+            self._internal.append(internal)
+            self._spread.append(spread)
+        return len(self._internal) - 1
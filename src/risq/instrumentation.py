@@ -0,0 +1,125 @@
+import contextlib
+import time
+from collections import Counter, defaultdict
+from collections.abc import Callable, Iterator
+
+StepHook = Callable[[object, int], None]
+
+
+class Stats:
+
+    def __init__(
+        self,
+        name: str = "",
+        parents: tuple["Stats", ...] = (),
+        hooks: tuple[StepHook, ...] = (),
+    ) -> None:
+        """Counters and timers of a method (or of everything inside `instrument`).
+
+        Args:
+            name: The prefix of the counters and timers in the parents, e.g. the
+                name of the method.
+            parents: Stats that everything counted here is added to as well.
+            hooks: Functions called with the method and the time, for every time
+                step a method computes.
+        """
+        self.name = name
+        self.parents = parents
+        self.hooks = list(hooks)
+
+        self.counters: Counter[str] = Counter()
+        self.timers: defaultdict[str, float] = defaultdict(float)  # in seconds
+
+    def count(self, counter: str, n: int = 1):
+        """Adds `n` to given counter."""
+        self.counters[counter] += n
+        for parent in self.parents:
+            parent.count(self._prefixed(counter), n)
+
+    def add_time(self, timer: str, seconds: float):
+        """Adds `seconds` to given timer."""
+        self.timers[timer] += seconds
+        for parent in self.parents:
+            parent.add_time(self._prefixed(timer), seconds)
+
+    @contextlib.contextmanager
+    def timer(self, timer: str) -> Iterator[None]:
+        """Adds the time spent inside the `with` block to given timer."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(timer, time.perf_counter() - start)
+
+    def step(self, method: object, time: int):
+        """Counts a time step computed by `method`, and calls the hooks."""
+        self.count("steps")
+        for hook in self._all_hooks():
+            hook(method, time)
+
+    def merge(self, other: "Stats"):
+        """Adds all counters and timers of `other`."""
+        self.counters.update(other.counters)
+        for timer, seconds in other.timers.items():
+            self.timers[timer] += seconds
+
+    def report(self) -> str:
+        """A table of all counters and timers."""
+        lines = []
+        for counter, n in sorted(self.counters.items()):
+            lines.append(f"{counter:<48} {n:>14}")
+        for timer, seconds in sorted(self.timers.items()):
+            lines.append(f"{timer:<48} {seconds:>12.4f} s")
+        return "\n".join(lines)
+
+    def _prefixed(self, key: str) -> str:
+        return f"{self.name}.{key}" if self.name else key
+
+    def _all_hooks(self) -> list[StepHook]:
+        hooks = list(self.hooks)
+        for parent in self.parents:
+            hooks += parent._all_hooks()
+        return hooks
+
+
+_active: list[Stats] = []  # stats of the `instrument` blocks we are in
+
+
+@contextlib.contextmanager
+def instrument(hooks: tuple[StepHook, ...] = ()) -> Iterator[Stats]:
+    """Collects the stats of all methods and optimizers created inside the `with`
+    block, e.g. to see where the time of a `steepest_descent` run goes:
+
+        with instrument() as stats:
+            steepest_descent(loss, values)
+        print(stats.report())
+
+    Counters and timers are prefixed with the name of the method. Losses evaluated
+    in worker processes (`num_workers`) are only counted as a whole. Outside of an
+    `instrument` block, methods do not collect any stats.
+
+    Args:
+        hooks: Functions called with the method and the time, for every time step
+            `SingleCellMethod` or `NeighboringCellMethod` computes.
+    """
+    stats = Stats(hooks=hooks)
+    _active.append(stats)
+    try:
+        yield stats
+    finally:
+        _active.remove(stats)
+
+
+def create_stats(name: str) -> Stats | None:
+    """The stats of a new method (or optimizer) with given name, if we are inside an
+    `instrument` block, otherwise `None`."""
+    if not _active:
+        return None
+    return Stats(name, parents=tuple(_active))
+
+
+def timer(stats: Stats | None, name: str) -> contextlib.AbstractContextManager:
+    """Same as `stats.timer(name)`, but does nothing if `stats` is `None`."""
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.timer(name)
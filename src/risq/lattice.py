@@ -0,0 +1,431 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from threading import BrokenBarrierError, Event, Thread
+
+import numpy as np
+from numpy.random import MT19937, RandomState, SeedSequence
+
+from risq.compiled_model import CompiledModel
+from risq.statistics import RunningStatistics
+
+MAX_STATES = 256  # the states of cells are stored as `np.uint8`
+WORKER_POLL_INTERVAL = 0.1  # seconds between checks that the workers are still alive
+
+
+def compile_tables(
+    compiled_model: CompiledModel, time_steps: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Tabulates the transition probabilities of a model for times 1, ..., `time_steps`.
+
+    Internal transitions are tabulated only for the states a cell can actually
+    transition to (see `CompiledModel.support_internal`), so that drawing the new
+    state takes time proportional to the number of possible transitions.
+
+    Returns:
+        A tuple `(spread, internal_targets, cumulative_internal)`. Here `spread` has
+        shape `(time_steps, num_states, num_states)` and `spread[t - 1][i][j]` is the
+        probability that a cell in state `i` overgrows a neighboring cell in state `j`.
+        A cell in state `j` can transition to the states `internal_targets[j]` (an
+        array of shape `(num_states, num_targets)`, padded with its last target), and
+        `cumulative_internal[t - 1][j][k]` is the probability that it transitions to
+        one of the first `k + 1` of them, both going from time `t - 1` to `t`.
+    """
+    assert (
+        compiled_model.num_states <= MAX_STATES
+    ), f"Lattices support at most {MAX_STATES} states ({compiled_model.num_states} given)"
+    internal, spread = compiled_model.tables_until(time_steps)
+
+    # Every column of a Markov matrix has at least one possible transition
+    support = compiled_model.support_internal.T  # [old][new]
+    num_states, num_targets = support.shape[0], support.sum(axis=1).max()
+    internal_targets = np.zeros((num_states, num_targets), dtype=np.uint8)
+    padding = np.zeros((num_states, num_targets), dtype=bool)
+    for old, row in enumerate(support):
+        targets = np.flatnonzero(row)
+        internal_targets[old, : len(targets)] = targets
+        internal_targets[old, len(targets) :] = targets[-1]
+        padding[old, len(targets) :] = True
+
+    # Padding repeats the last target with probability 0
+    probs = internal[:, internal_targets, np.arange(num_states)[:, np.newaxis]]
+    probs[:, padding] = 0.0
+    cumulative_internal = np.cumsum(probs, axis=-1)
+    return spread, internal_targets, cumulative_internal
+
+
+class TrialStreams:
+
+    def __init__(self, seeds: list[SeedSequence]) -> None:
+        """One random stream per trial, for a chunk of trials advanced together. Used in
+        place of a `RandomState` in `step_lattice`, it draws the random numbers of
+        every trial from its own stream.
+
+        As `step_cells` draws the same number of random numbers for every cell and
+        every time step, the random numbers used for a cell at a time step then only
+        depend on the seed of its trial: not on the other trials, on how the trials
+        are chunked or split over workers, or on the transition probabilities. So
+        simulations of models with nearby parameters use common random numbers, and
+        give nearby results.
+        """
+        self.random_states = [RandomState(MT19937(seed)) for seed in seeds]
+
+    def random_sample(self, size: tuple[int, ...]) -> np.ndarray:
+        """Random numbers of shape `size = (k, num_trials, ...)`, where
+        `[:, trial]` is drawn from the stream of the trial."""
+        k, num_trials, *shape = size
+        assert num_trials == len(self.random_states)
+        return np.stack(
+            [
+                random_state.random_sample((k, *shape))
+                for random_state in self.random_states
+            ],
+            axis=1,
+        )
+
+
+def step_lattice(
+    cells: np.ndarray,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    random_state: RandomState,
+) -> np.ndarray:
+    """Advances the lattice `cells` (of shape `(..., height, width)`) one time step.
+
+    All cells are updated at once with periodic boundary conditions, following the
+    same rules as `MonteCarlo2D.simulate_cell`: the four neighbors try to overgrow
+    the cell in a random order, and if none of them succeeds the cell transitions
+    according to the internal probabilities.
+    """
+    neighbors = np.stack(
+        [
+            np.roll(cells, -1, axis=-1),  # (x + 1, y)
+            np.roll(cells, 1, axis=-1),  # (x - 1, y)
+            np.roll(cells, -1, axis=-2),  # (x, y + 1)
+            np.roll(cells, 1, axis=-2),  # (x, y - 1)
+        ]
+    )
+    return step_cells(
+        cells, neighbors, spread, internal_targets, cumulative_internal, random_state
+    )
+
+
+def step_strip(
+    cells_with_halo: np.ndarray,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    random_state: RandomState,
+) -> np.ndarray:
+    """Advances a strip of rows of a lattice one time step, like `step_lattice`.
+
+    The strip `cells_with_halo[..., 1:-1, :]` is periodic in the horizontal direction,
+    and its first and last row are the rows of the lattice just above and below the
+    strip (the halo). Returns the new state of the strip, without the halo.
+    """
+    cells = cells_with_halo[..., 1:-1, :]
+    neighbors = np.stack(
+        [
+            np.roll(cells, -1, axis=-1),  # (x + 1, y)
+            np.roll(cells, 1, axis=-1),  # (x - 1, y)
+            cells_with_halo[..., 2:, :],  # (x, y + 1)
+            cells_with_halo[..., :-2, :],  # (x, y - 1)
+        ]
+    )
+    return step_cells(
+        cells, neighbors, spread, internal_targets, cumulative_internal, random_state
+    )
+
+
+def step_cells(
+    cells: np.ndarray,
+    neighbors: np.ndarray,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    random_state: RandomState,
+) -> np.ndarray:
+    """Advances `cells` (of any shape) one time step, given the states `neighbors` of
+    their four neighbors (an array of shape `(4, *cells.shape)`)."""
+    # One batch of random numbers per time step: four to decide whether each
+    # neighbor overgrows the cell, four to decide the order in which the neighbors
+    # try, and one for the internal transition
+    u = random_state.random_sample((9, *cells.shape))
+
+    # Cell is overgrown by neighbors with certain probabilities. Trying the
+    # successful neighbors in a random order means one of them is picked uniformly
+    overgrows = u[:4] < spread[neighbors, cells]
+    order = np.where(overgrows, u[4:8], 2.0)
+    first = order.argmin(axis=0)
+    overgrown = overgrows.any(axis=0)
+    attacker = np.take_along_axis(neighbors, first[np.newaxis], axis=0)[0]
+
+    # If not overgrown, cell changes according to internal probabilities
+    thresholds = cumulative_internal[cells][..., :-1]
+    target = (u[8][..., np.newaxis] >= thresholds).sum(axis=-1)
+    internal = internal_targets[cells, target]
+
+    return np.where(overgrown, attacker, internal)
+
+
+def count_states(cells: np.ndarray, num_states: int) -> np.ndarray:
+    """Counts the number of cells in each state, for every lattice in `cells`.
+
+    Args:
+        cells: The lattices, an array of shape `(num_lattices, height, width)`.
+        num_states: The number of states a cell can be in.
+
+    Returns:
+        An array of shape `(num_lattices, num_states)`, computed in a single `bincount`.
+    """
+    num_lattices = cells.shape[0]
+    offsets = np.arange(num_lattices, dtype=np.int64) * num_states
+    indices = offsets[:, np.newaxis] + cells.reshape(num_lattices, -1)
+    counts = np.bincount(indices.ravel(), minlength=num_lattices * num_states)
+    return counts.reshape(num_lattices, num_states)
+
+
+def simulate_trials(
+    num_trials: int,
+    height: int,
+    width: int,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    random_state: RandomState | None,
+    *,
+    initial_cells: np.ndarray | None = None,
+    trial_chunk_size: int = 1,
+    keep_cells: bool = False,
+    progress: bool = True,
+    trial_seeds: list[SeedSequence] | None = None,
+) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+    """Simulates `num_trials` lattices, starting from `initial_cells` (an array of shape
+    `(num_trials, height, width)`) or, if not given, with all cells in state 0.
+
+    Trials are advanced together in chunks of `trial_chunk_size` lattices. The
+    transition tables are as returned by `compile_tables`, one per time step.
+
+    If `trial_seeds` are given (one per trial), every trial draws from its own stream
+    instead of from `random_state`, see `TrialStreams`.
+
+    Returns:
+        A tuple `(statistics, final_counts, final_cells)`, where `statistics` holds the
+        mean and variance (over all trials) of the number of cells in state `i` after
+        `t + 1` time steps at index `[t, i]`, `final_counts[trial][i]` is the number of
+        cells in state `i` at the end of each trial and `final_cells` are the lattices
+        at the end of each trial (only if `keep_cells` is set, otherwise `None`).
+    """
+    from tqdm import tqdm
+
+    time_steps, num_states, _ = spread.shape
+
+    statistics = RunningStatistics((time_steps, num_states))
+    final_counts = np.zeros((num_trials, num_states), dtype=np.int32)
+    final_cells = (
+        np.zeros((num_trials, height, width), dtype=np.uint8) if keep_cells else None
+    )
+
+    chunks = range(0, num_trials, trial_chunk_size)
+    for start in tqdm(chunks, leave=False, disable=not progress):
+        end = min(start + trial_chunk_size, num_trials)
+
+        # Start trials with cells all in state 0, unless given otherwise
+        if initial_cells is None:
+            cells = np.zeros((end - start, height, width), dtype=np.uint8)
+        else:
+            cells = np.asarray(initial_cells[start:end], dtype=np.uint8)
+        counts = np.zeros((end - start, time_steps, num_states), dtype=np.int32)
+        final_counts[start:end] = count_states(cells, num_states)
+        if trial_seeds is not None:
+            random_state = TrialStreams(trial_seeds[start:end])
+
+        for t in range(time_steps):
+            # Simulate one time step (for all trials in the chunk)
+            cells = step_lattice(
+                cells, spread[t], internal_targets, cumulative_internal[t], random_state
+            )
+            counts[:, t] = count_states(cells, num_states)
+
+        statistics.update(counts)
+        if time_steps > 0:
+            final_counts[start:end] = counts[:, -1]
+        if keep_cells:
+            final_cells[start:end] = cells
+
+    return statistics, final_counts, final_cells
+
+
+def simulate_trials_tiled(
+    num_trials: int,
+    height: int,
+    width: int,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    seeds: list[SeedSequence],
+    *,
+    initial_cells: np.ndarray | None = None,
+    keep_cells: bool = False,
+    progress: bool = True,
+) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+    """Same as `simulate_trials`, but splits each lattice into horizontal strips, one
+    per seed, that are advanced in parallel by worker processes.
+
+    The lattice lives in shared memory (two copies, for the current and the next
+    time step), so every worker reads the rows just above and below its strip
+    directly from the lattice of the previous time step. Workers synchronize after
+    every time step, and their counts of cells per state are added up.
+    """
+    from tqdm import tqdm
+
+    time_steps, num_states, _ = spread.shape
+    num_workers = len(seeds)
+    assert height >= num_workers, "Each worker needs at least one row of the lattice"
+
+    statistics = RunningStatistics((time_steps, num_states))
+    final_counts = np.zeros((num_trials, num_states), dtype=np.int32)
+    final_cells = (
+        np.zeros((num_trials, height, width), dtype=np.uint8) if keep_cells else None
+    )
+
+    shm_cells = SharedMemory(create=True, size=2 * height * width)
+    shm_counts = SharedMemory(
+        create=True, size=max(1, num_workers * time_steps * num_states * 8)
+    )
+    cells = np.ndarray((2, height, width), dtype=np.uint8, buffer=shm_cells.buf)
+    counts = np.ndarray(
+        (num_workers, time_steps, num_states), dtype=np.int64, buffer=shm_counts.buf
+    )
+
+    # All workers and this process wait at the barrier after every time step
+    context = multiprocessing.get_context()
+    barrier = context.Barrier(num_workers + 1)
+    strips = np.array_split(range(height), num_workers)
+    workers = [
+        context.Process(
+            target=_strip_worker,
+            args=(
+                shm_cells.name,
+                shm_counts.name,
+                num_trials,
+                height,
+                width,
+                strip[0],
+                strip[-1] + 1,
+                i,
+                spread,
+                internal_targets,
+                cumulative_internal,
+                seed,
+                barrier,
+            ),
+            daemon=True,
+        )
+        for i, (strip, seed) in enumerate(zip(strips, seeds))
+    ]
+
+    # A worker that is killed (e.g. when out of memory) never reaches the barrier, so
+    # a watchdog aborts the barrier instead of letting this process wait forever
+    done = Event()
+    watchdog = Thread(target=_watch_workers, args=(workers, barrier, done), daemon=True)
+
+    try:
+        for worker in workers:
+            worker.start()
+        watchdog.start()
+
+        for trial in tqdm(range(num_trials), leave=False, disable=not progress):
+            # Start trial with cells all in state 0, unless given otherwise
+            cells[0] = 0 if initial_cells is None else initial_cells[trial]
+            final_counts[trial] = count_states(cells[:1], num_states)[0]
+
+            for _ in range(time_steps + 1):
+                barrier.wait()  # start of the trial, then the end of every time step
+
+            statistics.update(counts.sum(axis=0)[np.newaxis])
+            if time_steps > 0:
+                final_counts[trial] = counts[:, -1].sum(axis=0)
+            if keep_cells:
+                final_cells[trial] = cells[time_steps % 2]
+
+        for worker in workers:
+            worker.join()
+    except BrokenBarrierError:
+        raise RuntimeError("A worker of the tiled simulation failed") from None
+    finally:
+        done.set()
+        barrier.abort()  # in case of an exception, stops the workers
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        del cells, counts
+        for shm in (shm_cells, shm_counts):
+            shm.close()
+            shm.unlink()
+
+    return statistics, final_counts, final_cells
+
+
+def _watch_workers(workers: list, barrier, done: Event):
+    """Aborts `barrier` as soon as one of `workers` exits with an error, until `done`."""
+    while not done.wait(WORKER_POLL_INTERVAL):
+        if any(worker.exitcode not in (None, 0) for worker in workers):
+            barrier.abort()
+            return
+
+
+def _strip_worker(
+    shm_cells_name: str,
+    shm_counts_name: str,
+    num_trials: int,
+    height: int,
+    width: int,
+    start: int,
+    stop: int,
+    index: int,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    seed: SeedSequence,
+    barrier,
+):
+    """Advances rows `start` to `stop` of every trial of `simulate_trials_tiled`."""
+    time_steps, num_states, _ = spread.shape
+    random_state = RandomState(MT19937(seed))
+
+    shm_cells = SharedMemory(name=shm_cells_name)
+    shm_counts = SharedMemory(name=shm_counts_name)
+    cells = np.ndarray((2, height, width), dtype=np.uint8, buffer=shm_cells.buf)
+    counts = np.ndarray(
+        (barrier.parties - 1, time_steps, num_states),
+        dtype=np.int64,
+        buffer=shm_counts.buf,
+    )
+
+    # The rows of the strip, with the rows above and below it (periodically)
+    rows = np.arange(start - 1, stop + 1) % height
+
+    try:
+        for _ in range(num_trials):
+            barrier.wait()
+            for t in range(time_steps):
+                strip = step_strip(
+                    cells[t % 2, rows],
+                    spread[t],
+                    internal_targets,
+                    cumulative_internal[t],
+                    random_state,
+                )
+                cells[(t + 1) % 2, start:stop] = strip
+                counts[index, t] = np.bincount(strip.ravel(), minlength=num_states)
+                barrier.wait()
+    except BrokenBarrierError:
+        pass  # stopped by the main process
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        del cells, counts
+        shm_cells.close()
+        shm_counts.close()
@@ -1,4 +1,8 @@
+import math
 from abc import abstractmethod
+from collections.abc import Sequence
+
+import numpy as np
 
 from risq.model import State
 
@@ -20,7 +24,58 @@ class Method:
         """
         pass
 
+    def moments(
+        self, times: Sequence[int], state: State
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The probability and the (normalized) variance of given state at all given
+        times, as arrays. Methods override this to compute them in one pass."""
+        probability = np.array([self.probability(time, state) for time in times])
+        variance = np.array([self.variance(time, state) for time in times])
+        return probability, variance
+
+    def incidence_curve(
+        self, times: Sequence[int], state: State, num_cells: int, threshold: int = 1
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The mean and variance of the number of cells in given state out of
+        `num_cells` cells, and the probability that it reaches `threshold`, at all
+        given times, e.g. the probability of cancer at every age of a distribution.
+
+        Returns:
+            A tuple `(mean, variance, exceedance)` of arrays of the same length as
+            `times`, where `exceedance` is computed as in `exceedance_probability`.
+        """
+        probability, variance = self.moments(times, state)
+        mean = probability * num_cells
+        variance = variance * num_cells
+        return mean, variance, exceedance_probability(mean, variance, threshold)
+
     @abstractmethod
     def name() -> str:
         """The name of the method, used in the legend of plots."""
         pass
+
+
+def exceedance_probability(
+    mean: np.ndarray, variance: np.ndarray, threshold: int = 1
+) -> np.ndarray:
+    """The probability that a number of cells with given mean and variance is at least
+    `threshold`, assuming a normal distribution. Works for complex-step perturbed
+    values too (see `erf`)."""
+    sigma = np.sqrt(variance)
+    with np.errstate(divide="ignore"):  # a variance of 0 gives a probability of 0 or 1
+        return 0.5 * (1 - erf((threshold - mean) / (sigma * math.sqrt(2))))
+
+
+def erf(x):
+    """The error function, which also accepts complex-step perturbed arguments.
+
+    For an argument `x + ih` with `h` tiny, this returns `erf(x) + ih erf'(x)`,
+    so models created with `(1 + erf(value)) / 2` can be differentiated exactly.
+    """
+    x = np.asarray(x)
+    value = np.vectorize(math.erf, otypes=[float])(x.real)
+    if not np.iscomplexobj(x):
+        return value[()]
+
+    derivative = 2.0 / math.sqrt(math.pi) * np.exp(-(x.real**2))
+    return (value + 1j * x.imag * derivative)[()]
@@ -1,3 +1,7 @@
+import numpy as np
+
+from risq.compiled_model import CompiledModel, LazyCompiledModel
+
 State = int  # type alias State to int
 
 
@@ -46,6 +50,38 @@ class Model:
         """Probability that a cell in state `attacker` overgrows a neighboring cell in state `target`."""
         return self.probs_spread[attacker][target]
 
+    def compile(self) -> CompiledModel:
+        """Compiles the transition probabilities into dense NumPy arrays.
+
+        Subclasses whose probabilities depend on time should override this method.
+        Otherwise, if they override `prob_internal` or `prob_spread`, the tables are
+        tabulated from those at every time on first use (see `LazyCompiledModel`),
+        which is slower and disables the on-disk caches.
+        """
+        if any(
+            getattr(type(self), name) is not getattr(Model, name)
+            for name in ("prob_internal", "prob_spread")
+        ):
+            return LazyCompiledModel(self._tabulate)
+
+        probs_internal = np.array([self.probs_internal])
+        probs_spread = np.array([self.probs_spread])
+
+        # Use floats, unless the probabilities are complex (e.g. for complex-step
+        # differentiation)
+        dtype = np.result_type(probs_internal, probs_spread, float)
+        return CompiledModel(probs_internal.astype(dtype), probs_spread.astype(dtype))
+
+    def _tabulate(self, time: int) -> tuple[np.ndarray, np.ndarray]:
+        probs_internal = np.array(
+            [[self.prob_internal(time, X, Y) for Y in self.states] for X in self.states]
+        )
+        probs_spread = np.array(
+            [[self.prob_spread(time, X, Y) for Y in self.states] for X in self.states]
+        )
+        dtype = np.result_type(probs_internal, probs_spread, float)
+        return probs_internal.astype(dtype), probs_spread.astype(dtype)
+
     def validate(self) -> float:
         # Check dimensions of matrices
         assert len(self.probs_internal) == self.num_states and all(
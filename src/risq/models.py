@@ -38,9 +38,31 @@ def create_six_mutations_model(
     prob_spread: float,
 ):
     """Creates cell model with states H, S1, S2, S3, S4, S5, S6, C and D."""
-    num_states = 9
+    return create_k_mutations_model(
+        6, prob_mutate=prob_mutate, prob_dying=prob_dying, prob_spread=prob_spread
+    )
+
+
+def create_k_mutations_model(
+    k: int,
+    prob_mutate: float,
+    prob_dying: float,
+    prob_spread: float,
+):
+    """Creates cell model with states H, S1, ..., Sk, C and D.
+
+    A healthy cell (H) acquires mutations one at a time (S1, ..., Sk) with probability
+    `prob_mutate`, and becomes cancerous (C) with the next mutation. Healthy and
+    mutated cells die (D) with probability `prob_dying`, and dead cells are revived as
+    healthy cells. A cell with `i` mutations overgrows a neighboring cell with
+    probability `i * prob_spread`. The transition matrices are mostly zero, with
+    `O(k)` possible internal transitions.
+    """
+    num_states = k + 3
     num_neighbors = 4  # in a 2 dimensional grid, each cell has 4 neighbors
-    labels = ["H", "S1", "S2", "S3", "S4", "S5", "S6", "C", "D"]
+    labels = ["H", *(f"S{i}" for i in range(1, k + 1)), "C", "D"]
+    C = k + 1
+    D = k + 2
 
     x = prob_mutate
     y = prob_dying
@@ -52,29 +74,18 @@ def create_six_mutations_model(
     r = 1.0  # revival (D -> H)
     _d_ = 1.0 - r
 
-    probs_internal = [
-        [_i_, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, r],  # H
-        [x, _i_, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # S1
-        [0.0, x, _i_, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # S2
-        [0.0, 0.0, x, _i_, 0.0, 0.0, 0.0, 0.0, 0.0],  # S3
-        [0.0, 0.0, 0.0, x, _i_, 0.0, 0.0, 0.0, 0.0],  # S4
-        [0.0, 0.0, 0.0, 0.0, x, _i_, 0.0, 0.0, 0.0],  # S5
-        [0.0, 0.0, 0.0, 0.0, 0.0, x, _i_, 0.0, 0.0],  # S6
-        [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, x, _c_, 0.0],  # C
-        [y, y, y, y, y, y, y, 0.0, _d_],  # D
-    ]
+    probs_internal = [[0.0] * num_states for _ in range(num_states)]
+    for i in range(C):  # H, S1, ..., Sk
+        probs_internal[i][i] = _i_
+        probs_internal[i + 1][i] = x
+        probs_internal[D][i] = y
+    probs_internal[C][C] = _c_
+    probs_internal[0][D] = r
+    probs_internal[D][D] = _d_
 
-    probs_spread = [
-        [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # H
-        [1 * z, 1 * z, 1 * z, 1 * z, 1 * z, 1 * z, 1 * z, 1 * z, 1 * z],  # S1
-        [2 * z, 2 * z, 2 * z, 2 * z, 2 * z, 2 * z, 2 * z, 2 * z, 2 * z],  # S2
-        [3 * z, 3 * z, 3 * z, 3 * z, 3 * z, 3 * z, 3 * z, 3 * z, 3 * z],  # S3
-        [4 * z, 4 * z, 4 * z, 4 * z, 4 * z, 4 * z, 4 * z, 4 * z, 4 * z],  # S4
-        [5 * z, 5 * z, 5 * z, 5 * z, 5 * z, 5 * z, 5 * z, 5 * z, 5 * z],  # S5
-        [6 * z, 6 * z, 6 * z, 6 * z, 6 * z, 6 * z, 6 * z, 6 * z, 6 * z],  # S6
-        [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # C
-        [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # D
-    ]
+    probs_spread = [[0.0] * num_states for _ in range(num_states)]
+    for i in range(1, C):  # S1, ..., Sk
+        probs_spread[i] = [i * z] * num_states
 
     return Model(
         num_states=num_states,
@@ -1,8 +1,25 @@
-from numpy.random import RandomState
-from tqdm import tqdm
+import math
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
 
+import numpy as np
+from numpy.random import MT19937, RandomState, SeedSequence
+
+from risq.cache import ResultCache, model_key, schedule_indices
+from risq.instrumentation import Stats, create_stats, timer
+from risq.lattice import (
+    MAX_STATES,
+    compile_tables,
+    simulate_trials,
+    simulate_trials_tiled,
+)
 from risq.method import Method
 from risq.model import Model, State
+from risq.sparse_lattice import simulate_trials_sparse
+from risq.statistics import RunningStatistics
+
+DEFAULT_CHUNK_CELLS = 2**18
 
 
 class MonteCarlo2D(Method):
@@ -15,19 +32,90 @@ class MonteCarlo2D(Method):
         height: int,
         time_steps: int,
         seed: int | None = None,
+        engine: str = "cell",
+        trial_chunk_size: int | None = None,
+        num_workers: int = 1,
+        cache: ResultCache | None = None,
+        keep_lattices: bool = False,
+        common_random_numbers: bool = False,
     ):
+        """
+        Args:
+            model: The cell model to simulate.
+            num_trials: The number of independent trials.
+            width: The width of the (periodic) lattice.
+            height: The height of the (periodic) lattice.
+            time_steps: The number of time steps to simulate.
+            seed: Seed for the random number generator.
+            engine: Either `"cell"`, which updates the lattice cell by cell,
+                `"lattice"`, which updates the whole lattice at once using NumPy,
+                `"tiled"`, which splits every lattice into strips that are updated by
+                `num_workers` processes in parallel (for very large lattices), or
+                `"sparse"`, which only stores and updates the cells that are not in
+                state 0 and their neighbors (for large lattices with few such cells).
+                All engines simulate the same process, but draw different random numbers.
+            trial_chunk_size: The number of trials the `"lattice"` engine advances
+                together, as one `trial_chunk_size x height x width` array. This bounds
+                the memory used (roughly 100 bytes per cell per trial). By default,
+                chunks of about 2^18 cells are used.
+            num_workers: The number of worker processes the `"lattice"` engine splits
+                the trials over, or the `"tiled"` engine splits every lattice over.
+                Each worker draws from its own random stream derived from `seed`, so
+                results are reproducible for a given seed and number of workers.
+            cache: Optional on-disk cache to load and store the results in. Only used
+                when a `seed` is given, since results are random otherwise.
+            keep_lattices: Whether to keep the lattice of every trial at the end of the
+                simulation, which is needed to extend the time horizon with
+                `extend_time` (and takes `num_trials * width * height` bytes).
+            common_random_numbers: Whether every trial draws from its own random
+                stream, `SeedSequence(seed, spawn_key=(trial,))`, so the random numbers
+                used for a cell at a time step are the same for every model (see
+                `TrialStreams`). Then the results of models with nearby parameters are
+                strongly correlated, which makes losses computed from them smooth
+                enough to optimize. Requires a `seed` and the `"lattice"` engine, and
+                the results do not depend on `trial_chunk_size` or `num_workers`.
+        """
+        assert engine in (
+            "cell",
+            "lattice",
+            "tiled",
+            "sparse",
+        ), f"Unknown engine '{engine}' (expected 'cell', 'lattice', 'tiled' or 'sparse')"
+        assert num_workers == 1 or engine in (
+            "lattice",
+            "tiled",
+        ), "Multiple workers are only supported by the 'lattice' and 'tiled' engines"
+        assert not common_random_numbers or (
+            engine == "lattice" and seed is not None
+        ), "Common random numbers require a seed and the 'lattice' engine"
+        assert (
+            model.num_states <= MAX_STATES
+        ), f"MonteCarlo2D supports at most {MAX_STATES} states ({model.num_states} given)"
+
         self.model = model
+        self.compiled_model = model.compile()
         self.num_trials = num_trials
         self.width = width
         self.height = height
         self.time_steps = time_steps
         self.num_cells = self.width * self.height
+        self.engine = engine
+        self.trial_chunk_size = trial_chunk_size or max(
+            1, DEFAULT_CHUNK_CELLS // self.num_cells
+        )
+        self.num_workers = num_workers
+        self.keep_lattices = keep_lattices
+        self.common_random_numbers = common_random_numbers
 
-        self.results_sum_cells = None
-        self.results_sum_square_cells = None
-        self.results_final_counts = None
+        self.results_cells: RunningStatistics | None = None
+        self.results_final_counts: np.ndarray | None = None
+        self.results_lattices: np.ndarray | None = None
 
+        self.seed = seed
         self.random_state = RandomState(seed)
+        self.seed_sequence = SeedSequence(seed)  # for the streams of the workers
+        self.cache = cache
+        self.stats: Stats | None = create_stats("MonteCarlo2D")
 
     def name() -> str:
         return "Monte Carlo"
@@ -36,42 +124,49 @@ class MonteCarlo2D(Method):
         if time == 0:
             return 1.0 if state == 0 else 0.0
 
-        if self.results_sum_cells is None:
+        if self.results_cells is None:
             self.simulate()
 
-        return self.results_sum_cells[time - 1][state] / (
-            self.num_trials * self.width * self.height
-        )
+        return self.results_cells.mean[time - 1, state] / self.num_cells
 
     def variance(self, time: int, state: State) -> float:
         if time == 0:
             return 0.0
 
-        if self.results_sum_cells is None:
+        if self.results_cells is None:
             self.simulate()
 
-        count_per_trial = self.results_sum_cells[time - 1][state] / self.num_trials
-        square_count_per_trial = (
-            self.results_sum_square_cells[time - 1][state] / self.num_trials
-        )
-        variance = square_count_per_trial - count_per_trial**2
-        variance_per_cell = variance / (self.width * self.height)
+        return self.results_cells.variance[time - 1, state] / self.num_cells
 
-        return variance_per_cell
+    def moments(
+        self, times: Sequence[int], state: State
+    ) -> tuple[np.ndarray, np.ndarray]:
+        times = np.asarray(times, dtype=int)
+        if np.any(times > 0) and self.results_cells is None:
+            self.simulate()
 
-    def final_counts(self, state: State) -> list[int]:
-        """Returns a list (of length `self.num_trials`) of the number of cells in given state, for each trial."""
+        # At time 0 all cells are in state 0
+        probability = np.full(len(times), 1.0 if state == 0 else 0.0)
+        variance = np.zeros(len(times))
+        later = times > 0
+        if np.any(later):
+            probability[later] = self.results_cells.mean[times[later] - 1, state]
+            variance[later] = self.results_cells.variance[times[later] - 1, state]
+            probability[later] /= self.num_cells
+            variance[later] /= self.num_cells
+        return probability, variance
+
+    def final_counts(self, state: State) -> np.ndarray:
+        """Returns an array (of length `self.num_trials`) of the number of cells in given state, for each trial."""
         if self.results_final_counts is None:
             self.simulate()
 
-        return [
-            self.results_final_counts[trial][state] for trial in range(self.num_trials)
-        ]
+        return self.results_final_counts[:, state]
 
     def simulate_cell(
         self, time: int, cells: list[list[State]], x: int, y: int
     ) -> State:
-        old = cells[x][y]
+        old = cells[y][x]
 
         # Cell is overgrown by neighbors with certain probabilities
         neighbors = [
@@ -80,62 +175,562 @@ class MonteCarlo2D(Method):
             cells[(y + 1) % self.height][x],
             cells[(y - 1) % self.height][x],
         ]
+        internal, spread = self.compiled_model.tables(time)
         self.random_state.shuffle(neighbors)
+        draws = 1
         for i in range(4):
-            q = self.model.prob_spread(time, neighbors[i], old)
-            if q > 0.0 and self.random_state.random() < q:
-                return neighbors[i]
+            q = spread[neighbors[i], old]
+            if q > 0.0:
+                draws += 1
+                if self.random_state.random() < q:
+                    if self.stats is not None:
+                        self.stats.count("random_draws", draws)
+                    return neighbors[i]
 
         # If not overgrown, cell changes according to internal probabilities
-        return self.random_state.choice(
-            self.model.states,
-            p=[self.model.prob_internal(time, new, old) for new in self.model.states],
-        )
+        if self.stats is not None:
+            self.stats.count("random_draws", draws + 1)
+        return self.random_state.choice(self.model.states, p=internal[:, old])
 
     def simulate(self):
-        self.results_sum_cells = [
-            [0 for _ in range(self.model.num_states)] for _ in range(self.time_steps)
-        ]
-        self.results_sum_square_cells = [
-            [0 for _ in range(self.model.num_states)] for _ in range(self.time_steps)
+        key = self._cache_key()
+        if key is not None and self._load_from_cache(key):
+            return
+
+        with timer(self.stats, "simulate"):
+            results = self._run(self.num_trials, 0, self.time_steps)
+        self.results_cells, self.results_final_counts, self.results_lattices = results
+
+        if key is not None:
+            self.cache.store(key, self._state_arrays())
+
+    def add_trials(self, num_trials: int):
+        """Simulates `num_trials` more trials and adds them to the results."""
+        if self.results_cells is None:
+            self.simulate()
+
+        statistics, final_counts, lattices = self._run(
+            num_trials, 0, self.time_steps, first_trial=self.num_trials
+        )
+        self.results_cells.merge(statistics)
+        self.results_final_counts = np.concatenate(
+            [self.results_final_counts, final_counts]
+        )
+        if self.keep_lattices:
+            self.results_lattices = np.concatenate([self.results_lattices, lattices])
+        self.num_trials += num_trials
+
+    def standard_error(self, time: int, state: State) -> float:
+        """The standard error of `probability(time, state)`, estimated from the spread
+        of the trials (infinite with fewer than 2 trials)."""
+        if time == 0:
+            return 0.0
+
+        if self.results_cells is None:
+            self.simulate()
+
+        count = self.results_cells.count
+        if count < 2:
+            return math.inf
+
+        # Sample variance of the number of cells, divided by the number of trials
+        variance = self.results_cells.variance[time - 1, state] / (count - 1)
+        return math.sqrt(variance) / self.num_cells
+
+    def simulate_until(
+        self,
+        times: Sequence[int],
+        state: State,
+        *,
+        target_error: float | None = None,
+        relative_error: float | None = None,
+        max_trials: int | None = None,
+        max_seconds: float | None = None,
+        batch_size: int | None = None,
+    ) -> tuple[int, float]:
+        """Adds trials in batches until `probability(time, state)` is known to given
+        standard error at all given times, or until the trials or time run out.
+
+        Starts with the `num_trials` trials of the constructor (or of earlier runs). The
+        size of every next batch is estimated from the current standard error (at most
+        doubling the number of trials), unless `batch_size` is given.
+
+        Args:
+            times: The times at which the probability should be accurate.
+            state: The state of interest, e.g. the cancer state.
+            target_error: The largest standard error allowed (absolute).
+            relative_error: The largest standard error allowed, relative to the
+                probability. A probability of 0 is never accurate enough, so this
+                runs until the budget is used up if the state does not occur.
+            max_trials: The largest total number of trials.
+            max_seconds: The time budget (in seconds) of this call. Batches are made
+                small enough to (roughly) fit in the remaining time, judging by the
+                time per trial of the previous batch.
+            batch_size: The number of trials added per batch.
+
+        Returns:
+            A tuple `(num_trials, error)` with the total number of trials used and the
+            error achieved (the largest over all times, relative if `relative_error`
+            is given), which is above the target if the budget was used up first.
+        """
+        assert (target_error is None) != (
+            relative_error is None
+        ), "Give either `target_error` or `relative_error`"
+        assert (
+            max_trials is not None or max_seconds is not None
+        ), "Give a budget, `max_trials` or `max_seconds`"
+        start = perf_counter()
+        target = target_error if target_error is not None else relative_error
+
+        def achieved_error() -> float:
+            errors = [0.0]
+            for time in times:
+                error = self.standard_error(time, state)
+                if relative_error is not None:
+                    p = self.probability(time, state)
+                    error = error / p if p > 0.0 else math.inf
+                errors.append(float(error))
+            return max(errors)
+
+        error = achieved_error()
+        seconds_per_trial = None
+        while error > target:
+            remaining = math.inf if max_trials is None else max_trials - self.num_trials
+            if max_seconds is not None:
+                seconds = max_seconds - (perf_counter() - start)
+                if seconds <= 0.0:
+                    break
+                if seconds_per_trial is not None:
+                    remaining = min(remaining, max(1, int(seconds / seconds_per_trial)))
+            if remaining <= 0:
+                break
+
+            # The standard error decreases with the square root of the number of trials
+            if batch_size is not None:
+                num_trials = batch_size
+            elif math.isfinite(error):
+                needed = math.ceil(self.num_trials * (error / target) ** 2)
+                num_trials = min(max(needed - self.num_trials, 1), self.num_trials)
+            else:
+                num_trials = max(self.num_trials, 1)
+            num_trials = int(min(num_trials, remaining))
+            batch_start = perf_counter()
+            self.add_trials(num_trials)
+            seconds_per_trial = (perf_counter() - batch_start) / num_trials
+
+            if self.stats is not None:
+                self.stats.count("batches")
+            error = achieved_error()
+
+        return self.num_trials, error
+
+    def extend_time(self, time_steps: int):
+        """Continues all trials for `time_steps` more time steps, starting from the
+        lattices at the end of the current time horizon. Requires `keep_lattices`."""
+        if self.results_cells is None:
+            self.simulate()
+
+        assert (
+            self.results_lattices is not None
+        ), "Extending the time horizon requires `keep_lattices=True`"
+
+        statistics, final_counts, lattices = self._run(
+            self.num_trials, self.time_steps, time_steps, self.results_lattices
+        )
+
+        # All trials are continued, so the statistics of the new time steps can be
+        # appended to the current ones
+        results_cells = RunningStatistics(
+            (self.time_steps + time_steps, self.model.num_states)
+        )
+        results_cells.count = self.num_trials
+        results_cells.mean = np.concatenate([self.results_cells.mean, statistics.mean])
+        results_cells.m2 = np.concatenate([self.results_cells.m2, statistics.m2])
+
+        self.results_cells = results_cells
+        self.results_final_counts = final_counts
+        self.results_lattices = lattices
+        self.time_steps += time_steps
+
+    def save_checkpoint(self, path: str):
+        """Saves the configuration, accumulated statistics, lattices (if kept) and
+        random state to a `.npz` file, see `load_checkpoint`."""
+        if self.results_cells is None:
+            self.simulate()
+
+        # The schedule first, which tabulates models that are tabulated lazily
+        schedule = schedule_indices(self.compiled_model, self.time_steps)
+        np.savez(
+            path,
+            num_trials=self.num_trials,
+            width=self.width,
+            height=self.height,
+            time_steps=self.time_steps,
+            seed=-1 if self.seed is None else self.seed,
+            engine=self.engine,
+            trial_chunk_size=self.trial_chunk_size,
+            num_workers=self.num_workers,
+            keep_lattices=self.keep_lattices,
+            common_random_numbers=self.common_random_numbers,
+            probs_internal=self.compiled_model.probs_internal,
+            probs_spread=self.compiled_model.probs_spread,
+            schedule=schedule,
+            **self._state_arrays(),
+        )
+
+    @classmethod
+    def load_checkpoint(
+        cls, path: str, model: Model, cache: ResultCache | None = None
+    ) -> "MonteCarlo2D":
+        """Loads a simulation saved by `save_checkpoint`, which can then be continued
+        with `add_trials` and `extend_time`. The model should be the same as the one
+        used for the simulation (it is not stored itself)."""
+        with np.load(path) as arrays:
+            simulation = cls(
+                model,
+                num_trials=int(arrays["num_trials"]),
+                width=int(arrays["width"]),
+                height=int(arrays["height"]),
+                time_steps=int(arrays["time_steps"]),
+                seed=None if int(arrays["seed"]) == -1 else int(arrays["seed"]),
+                engine=str(arrays["engine"]),
+                trial_chunk_size=int(arrays["trial_chunk_size"]),
+                num_workers=int(arrays["num_workers"]),
+                cache=cache,
+                keep_lattices=bool(arrays["keep_lattices"]),
+                common_random_numbers=bool(arrays.get("common_random_numbers", False)),
+            )
+
+            compiled_model = simulation.compiled_model
+            schedule = schedule_indices(compiled_model, simulation.time_steps)
+            assert (
+                np.array_equal(schedule, arrays["schedule"])
+                and np.array_equal(
+                    compiled_model.probs_internal, arrays["probs_internal"]
+                )
+                and np.array_equal(compiled_model.probs_spread, arrays["probs_spread"])
+            ), "Model does not match the model of the checkpoint"
+
+            simulation._restore_state(arrays)
+
+        return simulation
+
+    def _state_arrays(self) -> dict[str, np.ndarray]:
+        """The results and random state, as a dictionary of arrays."""
+        _, keys, pos, has_gauss, cached_gaussian = self.random_state.get_state()
+        arrays = {
+            "count": np.array(self.results_cells.count),
+            "mean": self.results_cells.mean,
+            "m2": self.results_cells.m2,
+            "final_counts": self.results_final_counts,
+            "rng_keys": keys,
+            "rng_pos": np.array(pos),
+            "rng_has_gauss": np.array(has_gauss),
+            "rng_cached_gaussian": np.array(cached_gaussian),
+            "seed_entropy": np.array(str(self.seed_sequence.entropy)),
+            "seed_children": np.array(self.seed_sequence.n_children_spawned),
+        }
+        if self.results_lattices is not None:
+            arrays["lattices"] = self.results_lattices
+        return arrays
+
+    def _restore_state(self, arrays) -> bool:
+        """Restores the results and random state from `_state_arrays`."""
+        if self.keep_lattices and "lattices" not in arrays:
+            return False
+
+        self.results_cells = RunningStatistics((self.time_steps, self.model.num_states))
+        self.results_cells.count = int(arrays["count"])
+        self.results_cells.mean[...] = arrays["mean"]
+        self.results_cells.m2[...] = arrays["m2"]
+        self.results_final_counts = arrays["final_counts"]
+        self.results_lattices = arrays["lattices"] if self.keep_lattices else None
+
+        self.random_state.set_state(
+            (
+                "MT19937",
+                np.array(arrays["rng_keys"]),
+                int(arrays["rng_pos"]),
+                int(arrays["rng_has_gauss"]),
+                float(arrays["rng_cached_gaussian"]),
+            )
+        )
+        self.seed_sequence = SeedSequence(
+            int(str(arrays["seed_entropy"])),
+            n_children_spawned=int(arrays["seed_children"]),
+        )
+        return True
+
+    def _cache_key(self) -> str | None:
+        if self.cache is None or self.seed is None:
+            return None
+
+        # Everything the (seeded) results depend on. The schedule goes first, which
+        # tabulates models that are tabulated lazily up to the time horizon
+        schedule = schedule_indices(self.compiled_model, self.time_steps)
+        return self.cache.key(
+            "MonteCarlo2D",
+            self.engine,
+            *model_key(self.compiled_model, self.model.num_neighbors),
+            schedule,
+            self.width,
+            self.height,
+            self.time_steps,
+            self.num_trials,
+            self.seed,
+            self.trial_chunk_size if self.engine == "lattice" else None,
+            self.num_workers,
+            self.common_random_numbers,
+        )
+
+    def _load_from_cache(self, key: str) -> bool:
+        arrays = self.cache.load(key)
+        hit = arrays is not None and self._restore_state(arrays)
+        if self.stats is not None:
+            self.stats.count("cache.hits" if hit else "cache.misses")
+        return hit
+
+    def _run(
+        self,
+        num_trials: int,
+        time_start: int,
+        time_steps: int,
+        initial_cells: np.ndarray | None = None,
+        first_trial: int = 0,
+    ) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+        """Simulates `num_trials` trials from time `time_start` to `time_start +
+        time_steps`, starting from `initial_cells` (or all cells in state 0). With
+        common random numbers, the trials are numbered from `first_trial`.
+
+        Returns:
+            A tuple `(statistics, final_counts, final_lattices)`, see `simulate_trials`.
+        """
+        if self.stats is not None:
+            self.stats.count("trials", num_trials)
+            self.stats.count("cell_updates", num_trials * self.num_cells * time_steps)
+
+        if self.engine in ("lattice", "tiled", "sparse"):
+            return self._run_lattice(
+                num_trials, time_start, time_steps, initial_cells, first_trial
+            )
+        return self._run_cells(num_trials, time_start, time_steps, initial_cells)
+
+    def _trial_seeds(
+        self, first_trial: int, num_trials: int, time_start: int
+    ) -> list[SeedSequence]:
+        """The seeds of the streams of given trials, for common random numbers. Trials
+        continued with `extend_time` draw from a separate stream per starting time."""
+        key = () if time_start == 0 else (time_start,)
+        return [
+            SeedSequence(self.seed, spawn_key=(trial, *key))
+            for trial in range(first_trial, first_trial + num_trials)
         ]
 
-        self.results_final_counts = []
+    def _run_cells(
+        self,
+        num_trials: int,
+        time_start: int,
+        time_steps: int,
+        initial_cells: np.ndarray | None,
+    ) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+        from tqdm import tqdm
+
+        statistics = RunningStatistics((time_steps, self.model.num_states))
+        final_counts = np.zeros((num_trials, self.model.num_states), dtype=np.int32)
+        final_lattices = (
+            np.zeros((num_trials, self.height, self.width), dtype=np.uint8)
+            if self.keep_lattices
+            else None
+        )
 
-        for _ in tqdm(range(self.num_trials), leave=False):
-            # Start trial with cells all in state 0
-            cells = [[0 for x in range(self.width)] for y in range(self.height)]
+        for trial in tqdm(range(num_trials), leave=False):
+            # Start trial with cells all in state 0, unless given otherwise
+            if initial_cells is None:
+                cells = [[0 for x in range(self.width)] for y in range(self.height)]
+            else:
+                cells = initial_cells[trial].tolist()
+            counts = np.zeros((time_steps, self.model.num_states), dtype=np.int32)
 
-            for t in range(self.time_steps):
+            for t in range(time_steps):
                 # Simulate one time step
+                time = time_start + t + 1
                 cells = [
-                    [self.simulate_cell(t + 1, cells, x, y) for x in range(self.width)]
+                    [self.simulate_cell(time, cells, x, y) for x in range(self.width)]
                     for y in range(self.height)
                 ]
 
-                # Update `self.results`
-                for state in self.model.states:
-                    count = len(
-                        [
-                            1
-                            for y in range(self.height)
-                            for x in range(self.width)
-                            if cells[y][x] == state
-                        ]
-                    )
-                    self.results_sum_cells[t][state] += count
-                    self.results_sum_square_cells[t][state] += count**2
-
-            self.results_final_counts.append(
-                [
-                    len(
-                        [
-                            1
-                            for y in range(self.height)
-                            for x in range(self.width)
-                            if cells[y][x] == state
-                        ]
-                    )
-                    for state in self.model.states
-                ]
+                # Count the number of cells in each state
+                for row in cells:
+                    for state in row:
+                        counts[t, state] += 1
+
+            # Update results
+            statistics.update(counts[np.newaxis])
+            final_counts[trial] = np.bincount(
+                np.ravel(cells), minlength=self.model.num_states
+            )
+            if self.keep_lattices:
+                final_lattices[trial] = cells
+
+        return statistics, final_counts, final_lattices
+
+    def _run_lattice(
+        self,
+        num_trials: int,
+        time_start: int,
+        time_steps: int,
+        initial_cells: np.ndarray | None,
+        first_trial: int = 0,
+    ) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+        trial_seeds = None
+        if self.common_random_numbers:
+            trial_seeds = self._trial_seeds(first_trial, num_trials, time_start)
+
+        spread, internal_targets, cumulative_internal = compile_tables(
+            self.compiled_model, time_start + time_steps
+        )
+        spread = spread[time_start:]
+        cumulative_internal = cumulative_internal[time_start:]
+
+        if self.engine == "tiled":
+            results = [
+                simulate_trials_tiled(
+                    num_trials,
+                    self.height,
+                    self.width,
+                    spread,
+                    internal_targets,
+                    cumulative_internal,
+                    self.seed_sequence.spawn(self.num_workers),
+                    initial_cells=initial_cells,
+                    keep_cells=self.keep_lattices,
+                )
+            ]
+        elif self.engine == "sparse":
+            results = [
+                simulate_trials_sparse(
+                    num_trials,
+                    self.height,
+                    self.width,
+                    spread,
+                    internal_targets,
+                    cumulative_internal,
+                    self.random_state,
+                    initial_cells=initial_cells,
+                    keep_cells=self.keep_lattices,
+                )
+            ]
+        elif self.num_workers == 1:
+            results = [
+                simulate_trials(
+                    num_trials,
+                    self.height,
+                    self.width,
+                    spread,
+                    internal_targets,
+                    cumulative_internal,
+                    self.random_state,
+                    initial_cells=initial_cells,
+                    trial_chunk_size=self.trial_chunk_size,
+                    keep_cells=self.keep_lattices,
+                    trial_seeds=trial_seeds,
+                )
+            ]
+        else:
+            results = self._run_lattice_parallel(
+                num_trials,
+                spread,
+                internal_targets,
+                cumulative_internal,
+                initial_cells,
+                trial_seeds,
             )
+
+        # Merge the results of all workers
+        statistics = RunningStatistics((time_steps, self.model.num_states))
+        for worker_statistics, _, _ in results:
+            statistics.merge(worker_statistics)
+        final_counts = np.concatenate([final_counts for _, final_counts, _ in results])
+        final_lattices = (
+            np.concatenate([lattices for _, _, lattices in results])
+            if self.keep_lattices
+            else None
+        )
+        return statistics, final_counts, final_lattices
+
+    def _run_lattice_parallel(
+        self,
+        num_trials: int,
+        spread: np.ndarray,
+        internal_targets: np.ndarray,
+        cumulative_internal: np.ndarray,
+        initial_cells: np.ndarray | None,
+        trial_seeds: list[SeedSequence] | None = None,
+    ) -> list[tuple[RunningStatistics, np.ndarray, np.ndarray | None]]:
+        from tqdm import tqdm
+
+        # Split trials (as evenly as possible) over the workers, each with its own seed
+        trials = np.array_split(range(num_trials), self.num_workers)
+        seeds = self.seed_sequence.spawn(self.num_workers)
+
+        with ProcessPoolExecutor(self.num_workers) as executor:
+            futures = [
+                executor.submit(
+                    _simulate_trials_worker,
+                    seed,
+                    len(worker_trials),
+                    self.height,
+                    self.width,
+                    spread,
+                    internal_targets,
+                    cumulative_internal,
+                    (
+                        None
+                        if initial_cells is None
+                        else initial_cells[worker_trials[0] : worker_trials[-1] + 1]
+                    ),
+                    self.trial_chunk_size,
+                    self.keep_lattices,
+                    (
+                        None
+                        if trial_seeds is None
+                        else trial_seeds[worker_trials[0] : worker_trials[-1] + 1]
+                    ),
+                )
+                for seed, worker_trials in zip(seeds, trials)
+                if len(worker_trials) > 0
+            ]
+            for _ in tqdm(as_completed(futures), total=len(futures), leave=False):
+                pass
+
+            # Keep the order of the workers, so results do not depend on timing
+            return [future.result() for future in futures]
+
+
+def _simulate_trials_worker(
+    seed: SeedSequence,
+    num_trials: int,
+    height: int,
+    width: int,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    initial_cells: np.ndarray | None,
+    trial_chunk_size: int,
+    keep_cells: bool,
+    trial_seeds: list[SeedSequence] | None,
+) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+    return simulate_trials(
+        num_trials,
+        height,
+        width,
+        spread,
+        internal_targets,
+        cumulative_internal,
+        RandomState(MT19937(seed)),
+        initial_cells=initial_cells,
+        trial_chunk_size=trial_chunk_size,
+        keep_cells=keep_cells,
+        progress=False,
+        trial_seeds=trial_seeds,
+    )
@@ -1,201 +1,114 @@
 import itertools
+from collections.abc import Sequence
 
-from risq.method import Method
-from risq.model import Model, State
-
+import numpy as np
 
-class NeighboringCellMethod(Method):
-
-    def __init__(self, model: Model):
+from risq.cache import PrefixCache, PrefixKeys, ResultCache
+from risq.instrumentation import Stats, create_stats, timer
+from risq.model import Model, State
+from risq.trajectory_method import TrajectoryMethod
+
+DEFAULT_VARIANCE_ORDER = 4  # this seems sufficient
+MAX_VARIANCE_ORDER = 10_000  # when chosen automatically
+VARIANCE_TOLERANCE = 1e-12  # relative size of the last term, when chosen automatically
+
+
+class NeighboringCellMethod(TrajectoryMethod):
+
+    TRAJECTORIES = {"single": "trajectory_single", "pairs": "trajectory_pairs"}
+
+    def __init__(
+        self,
+        model: Model,
+        cache: ResultCache | None = None,
+        prefix_cache: PrefixCache | None = None,
+        variance_order: int | None = DEFAULT_VARIANCE_ORDER,
+    ):
+        """
+        Args:
+            model: The cell model.
+            cache: Optional on-disk cache to load and store the trajectories in. Not
+                used for models that are tabulated lazily (see `Model.compile`).
+            prefix_cache: Optional in-memory cache of trajectory prefixes, shared with
+                other methods, to start from the latest time at which the schedule of
+                the model agrees with an earlier evaluation (e.g. the
+                `DEFAULT_PREFIX_CACHE` of `risq.cache`, when fitting a `CombinedModel`
+                whose default model is fixed).
+            variance_order: The number of correlation terms (cells at distance 1, 2,
+                ...) included in the variance. Use `None` to add terms until they
+                become negligible.
+        """
         self.model = model
-        self.memory_prob_states = {}
-        self.memory_prob_overgrown = {}
-        self.variance_order = 4  # this seems sufficient
+        self.compiled_model = model.compile()
+        self.trajectory_single: list[np.ndarray] = []  # `p[X]`, per time
+        self.trajectory_pairs: list[np.ndarray] = []  # `p[X, Y]`, per time
+        self.variance_order = variance_order
+        self.cache = None if self.compiled_model.lazy else cache
+        self.prefix_cache = prefix_cache
+        self._prefix_keys: PrefixKeys | None = None
+        self.stats: Stats | None = create_stats("NeighboringCellMethod")
 
     def name() -> str:
         return "Neighboring cells"
 
     def probability(self, time: int, state: State):
-        for t in range(0, time, 16):  # (to prevent max recursion exceeded)
-            self.compute_probability(t, (state,))
         return self.compute_probability(time, (state,))
 
     def variance(self, time: int, state: State) -> float:
-        # Probability of any cell being in given state at given time
-        p = self.probability(time, state)
-
-        # Compute variance
-        var = 0.0
-
-        # First order term
-        var += p - p**2
-
-        # Higher order terms
-        for k in range(0, self.variance_order):
-            # Compute probability q of pattern (state, *, ..., *, state)
-            # where pattern consists of k `*` in the middle
-            q = 0.0
-            for middle in itertools.product(self.model.states, repeat=k):
-                q += self.compute_probability(time, (state, *middle, state))
-
-            # NOTE: This assumes a 2-dimensional topology:
-            # The number of neighbors (k + 1) steps away is (1 + k) * `num_neighbors`
-            var += (1 + k) * self.model.num_neighbors * (q - p**2)
-
-        return var
+        self.advance(time)
+        with timer(self.stats, "variance"):
+            return float(
+                variance_neighboring_cell(
+                    self.trajectory_single[time],
+                    self.trajectory_pairs[time],
+                    state,
+                    self.model.num_neighbors,
+                    self.variance_order,
+                )
+            )
+
+    def moments(
+        self, times: Sequence[int], state: State
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Advance once, and compute the variances of all times as a batch
+        self.advance(max(times, default=0))
+        num_states = self.model.num_states
+        p = np.array([self.trajectory_single[time] for time in times])
+        P = np.array([self.trajectory_pairs[time] for time in times])
+        with timer(self.stats, "variance"):
+            variance = variance_neighboring_cell(
+                p.reshape(len(times), num_states),
+                P.reshape(len(times), num_states, num_states),
+                state,
+                self.model.num_neighbors,
+                self.variance_order,
+            )
+        return p[:, state], variance
 
     def compute_probability(self, time: int, pattern: tuple[State, ...]) -> float:
-        # Sorting pattern gives a factor ~2 speedup
-        if len(pattern) == 2 and pattern[1] < pattern[0]:
-            pattern = (pattern[1], pattern[0])
-
-        # Recall result from memory if possible
-        key = (time, pattern)
-        if key in self.memory_prob_states:
-            return self.memory_prob_states[key]
-
-        # Otherwise, compute the probability and store in memory
-        prob = self._compute_probability(time, pattern)
-        self.memory_prob_states[key] = prob
-        return prob
-
-    def _compute_probability(self, time: int, pattern: tuple[State, ...]) -> float:
-        # Base case: at time 0 all cells are healthy
-        if time == 0:
-            return self.model.prob_initial(pattern)
+        self.advance(time)
+        p = self.trajectory_single[time]
+        P = self.trajectory_pairs[time]
 
         # Single cell
         if len(pattern) == 1:
             (X,) = pattern
-
-            # For stability reasons: compute prob of last state as 1 - sum prob other states
-            if X == self.model.states[-1]:
-                return 1.0 - sum(
-                    self.compute_probability(time, (U,)) for U in self.model.states[:-1]
-                )
-
-            p = 0.0
-            for Y in self.model.states:
-                # Probability that cell was in state Y previous time step
-                p_Y = self.compute_probability(time - 1, (Y,))
-
-                if p_Y == 0.0:
-                    continue
-
-                # Probability that Y is overgrown by some neighboring X
-                p_XY = self.compute_probability(time - 1, (X, Y))
-                p_X_overgrows_Y = self.model.prob_spread(time, X, Y)
-                p_Y_overgrown_by_some_X = (
-                    1.0
-                    - (1.0 - p_XY / p_Y * p_X_overgrows_Y) ** self.model.num_neighbors
-                )
-                p += p_Y * p_Y_overgrown_by_some_X
-
-                # When Y is not overgrown by any neighbor, look at the internal probabilities
-                p_X_from_Y = self.model.prob_internal(time, X, Y)
-                p_Y_not_overgrown = 1.0 - self.compute_probability_overgrown(time, Y)
-                p_Y_not_overgrown_at_all = p_Y_not_overgrown**self.model.num_neighbors
-                p += p_Y * p_Y_not_overgrown_at_all * p_X_from_Y
-
-            return p
+            return float(p[X])
 
         # Two cells
         if len(pattern) == 2:
             X, Y = pattern
-
-            # For stability, compute prob of last state as 1 - sum prob other states
-            if Y == self.model.states[-1]:
-                return self.compute_probability(time, (X,)) - sum(
-                    self.compute_probability(time, (X, U))
-                    for U in self.model.states[:-1]
-                )
-            if X == self.model.states[-1]:
-                return self.compute_probability(time, (Y,)) - sum(
-                    self.compute_probability(time, (U, Y))
-                    for U in self.model.states[:-1]
-                )
-
-            p = 0.0
-            for Z in self.model.states:
-                for W in self.model.states:
-                    # Probability that cells were in state (Z, W) previous time step
-                    p_ZW = self.compute_probability(time - 1, (Z, W))
-                    p_Z = self.compute_probability(time - 1, (Z,))
-                    p_W = self.compute_probability(time - 1, (W,))
-
-                    if p_Z == 0.0 or p_W == 0.0:
-                        continue
-
-                    # Probability that Z is overgrown by some neighboring X
-                    p_XZ = self.compute_probability(time - 1, (X, Z))
-                    p_X_overgrows_Z = self.model.prob_spread(time, X, Z)
-                    p_Z_overgrown_by_some_X = 1.0 - (
-                        (1.0 - p_XZ / p_Z * p_X_overgrows_Z)
-                        ** (self.model.num_neighbors - 1)
-                        * ((1.0 - p_X_overgrows_Z) if W == X else 1.0)
-                    )
-
-                    # Probability that Z is not overgrown at all
-                    p_Z_not_overgrown = 1.0 - self.compute_probability_overgrown(
-                        time, Z
-                    )  # i.e. by a single (random) neighbor
-                    p_W_overgrows_Z = self.model.prob_spread(time, W, Z)
-                    p_Z_not_overgrown_at_all = p_Z_not_overgrown ** (
-                        self.model.num_neighbors - 1
-                    ) * (1.0 - p_W_overgrows_Z)
-
-                    # Probability that W is overgrown by some neighboring Y
-                    p_YW = self.compute_probability(time - 1, (Y, W))
-                    p_Y_overgrows_W = self.model.prob_spread(time, Y, W)
-                    p_W_overgrown_by_some_Y = 1.0 - (
-                        (1.0 - p_YW / p_W * p_Y_overgrows_W)
-                        ** (self.model.num_neighbors - 1)
-                        * ((1.0 - p_Y_overgrows_W) if Z == Y else 1.0)
-                    )
-
-                    # Probability that W is not overgrown at all
-                    p_W_not_overgrown = 1.0 - self.compute_probability_overgrown(
-                        time, W
-                    )  # i.e. by a single (random) neighbor
-                    p_Z_overgrows_W = self.model.prob_spread(time, Z, W)
-                    p_W_not_overgrown_at_all = p_W_not_overgrown ** (
-                        self.model.num_neighbors - 1
-                    ) * (1.0 - p_Z_overgrows_W)
-
-                    # Internal probabilities
-                    p_X_from_Z = self.model.prob_internal(time, X, Z)
-                    p_Y_from_W = self.model.prob_internal(time, Y, W)
-
-                    # Use:
-                    # - p_Z_overgrown_by_some_X
-                    # - p_W_overgrown_by_some_Y
-                    # - p_Z_not_overgrown_at_all
-                    # - p_W_not_overgrown_at_all
-                    # - p_X_from_Z
-                    # - p_Y_from_W
-                    p += (
-                        p_ZW
-                        * (
-                            p_Z_overgrown_by_some_X
-                            + p_Z_not_overgrown_at_all * p_X_from_Z
-                        )
-                        * (
-                            p_W_overgrown_by_some_Y
-                            + p_W_not_overgrown_at_all * p_Y_from_W
-                        )
-                    )
-
-            return p
+            return float(P[X, Y])
 
         # More than 2 cells: split pattern into left and right
         if len(pattern) > 2:
             x, y = 1.0, 1.0
             for U, V in itertools.pairwise(pattern):
-                x *= self.compute_probability(time, (U, V))
+                x *= P[U, V]
             for U in pattern[1:-1]:
-                y *= self.compute_probability(time, (U,))
+                y *= p[U]
 
-            return (x / y) if y > 0.0 else 0.0
+            return float(x / y) if y > 0.0 else 0.0
 
         raise NotImplementedError(
             f"Could not compute probability of pattern '{pattern}' at time {time}"
@@ -205,22 +118,215 @@ class NeighboringCellMethod(Method):
         """Computes the probability that a cell in given state at given time is overgrown
         by a random neighboring cell. (Going from `time - 1` to `time`).
         This is of course given that the cell is in that state at that time."""
-        # Recall result from memory if possible
-        key = (time, state)
-        if key in self.memory_prob_overgrown:
-            return self.memory_prob_overgrown[key]
-
-        # Otherwise, compute the probability and store in memory
-        prob = self._compute_probability_overgrown(time, state)
-        self.memory_prob_overgrown[key] = prob
-        return prob
-
-    def _compute_probability_overgrown(self, time: int, state: State) -> float:
-        Y = state
-        p_Y = self.compute_probability(time - 1, (Y,))
-        p_Y_not_overgrown = 0.0
-        for Z in self.model.states:
-            p_ZY = self.compute_probability(time - 1, (Z, Y))
-            p_Z_overgrows_Y = self.model.prob_spread(time, Z, Y)
-            p_Y_not_overgrown += p_ZY / p_Y * (1.0 - p_Z_overgrows_Y)
-        return 1.0 - p_Y_not_overgrown
+        self.advance(time - 1)
+        _, spread = self.compiled_model.tables(time)
+        p_overgrown = probability_overgrown(
+            self.trajectory_single[time - 1], self.trajectory_pairs[time - 1], spread
+        )
+        return float(p_overgrown[state])
+
+    def advance(self, time: int):
+        """Computes the probabilities of all single cell states and all pairs of
+        neighboring cell states for all times up to given time."""
+        # Base case: at time 0 all cells are healthy
+        if not self.trajectory_single:
+            self.trajectory_single.append(
+                np.array([self.model.prob_initial((X,)) for X in self.model.states])
+            )
+            self.trajectory_pairs.append(
+                np.array(
+                    [
+                        [self.model.prob_initial((X, Y)) for Y in self.model.states]
+                        for X in self.model.states
+                    ]
+                )
+            )
+            if self.cache is not None:
+                self._load_from_cache()
+
+        if len(self.trajectory_single) > time:
+            return
+
+        with timer(self.stats, "advance"):
+            if self.prefix_cache is not None:
+                self._load_prefix(time)
+            start = len(self.trajectory_single)
+
+            while len(self.trajectory_single) <= time:
+                t = len(self.trajectory_single)
+                internal, spread = self.compiled_model.tables(t)
+                p, P = step_neighboring_cell(
+                    self.trajectory_single[-1],
+                    self.trajectory_pairs[-1],
+                    internal,
+                    spread,
+                    self.model.num_neighbors,
+                )
+                self.trajectory_single.append(p)
+                self.trajectory_pairs.append(P)
+                if self.stats is not None:
+                    self.stats.step(self, t)
+
+            if self.prefix_cache is not None:
+                self._store_prefixes(start, time)
+            if self.cache is not None:
+                self._store_in_cache()
+
+
+def probability_overgrown(p: np.ndarray, P: np.ndarray, spread: np.ndarray):
+    """The probability that a cell in state `Y` is overgrown by a random neighboring
+    cell, given the probabilities `p[..., Y]` of single cells and `P[..., X, Y]` of
+    pairs of neighboring cells. Zero for states `Y` with `p[..., Y] == 0`."""
+    # Conditional probability `P[Z, Y] / p[Y]` that a neighbor of Y is in state Z
+    p_Z_given_Y = np.divide(
+        P,
+        p[..., np.newaxis, :],
+        out=np.zeros_like(P),
+        where=p.real[..., np.newaxis, :] != 0,
+    )
+    p_Y_not_overgrown = (p_Z_given_Y * (1.0 - spread)).sum(axis=-2)
+    return np.where(p.real != 0, 1.0 - p_Y_not_overgrown, 0.0)
+
+
+def step_neighboring_cell(
+    p: np.ndarray,
+    P: np.ndarray,
+    internal: np.ndarray,
+    spread: np.ndarray,
+    num_neighbors: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Advances the probabilities `p[..., X]` that a cell is in state `X` and
+    `P[..., X, Y]` that two neighboring cells are in states `(X, Y)` one time step.
+
+    Leading axes of all arrays are treated as batch axes. States `Z` with
+    `p[..., Z] == 0` are skipped, as in the original recursion. (Only the real part
+    is compared, so complex-step perturbed probabilities are propagated as well.)
+    """
+    n = num_neighbors
+    valid = p.real != 0
+
+    # Conditional probability `P[X, Z] / p[Z]` that a neighbor of Z is in state X
+    p_X_given_Z = np.divide(
+        P, p[..., np.newaxis, :], out=np.zeros_like(P), where=valid[..., np.newaxis, :]
+    )
+    p_X_overgrows_Z = p_X_given_Z * spread
+    p_Z_not_overgrown = 1.0 - probability_overgrown(p, P, spread)
+
+    # Single cell
+    # - probability that Y is overgrown by some neighboring X
+    # - when Y is not overgrown by any neighbor, look at the internal probabilities
+    p_Y_overgrown_by_some_X = 1.0 - (1.0 - p_X_overgrows_Z) ** n
+    p_X_from_Y = (p_Z_not_overgrown**n)[..., np.newaxis, :] * internal
+    p_next = np.einsum(
+        "...xy,...y->...x",
+        p_Y_overgrown_by_some_X + p_X_from_Y,
+        np.where(valid, p, 0.0),
+    )
+
+    # For stability reasons: compute prob of last state as 1 - sum prob other states
+    p_next[..., -1] = 1.0 - p_next[..., :-1].sum(axis=-1)
+
+    # Two cells (Z, W) -> (X, Y). The factor F[X, Z, W] is the probability that Z
+    # becomes X given its neighbor W, either by being overgrown by some neighbor in
+    # state X (the neighbor W overgrows with probability `spread[X, Z]` if W == X)
+    # or by not being overgrown at all and going to X internally. It splits into
+    #   F[X, Z, W] = G[X, Z] + D[X, Z] [X == W] - K[X, Z] spread[W, Z],
+    # so the sum over (Z, W) of P[Z, W] F[X, Z, W] F[Y, W, Z] takes O(S^3) instead of
+    # O(S^4) operations: the products of two terms without [X == W] are matrix
+    # products, and the other products reduce to (sums over) single elements
+    p_others_not_overgrown = (1.0 - p_X_overgrows_Z) ** (n - 1)
+    K = internal * (p_Z_not_overgrown ** (n - 1))[..., np.newaxis, :]
+    G = 1.0 - p_others_not_overgrown + K
+    D = p_others_not_overgrown * spread
+
+    P_ZW = np.where(valid[..., :, np.newaxis] & valid[..., np.newaxis, :], P, 0.0)
+    spread_T = np.swapaxes(spread, -1, -2)
+    G_T = np.swapaxes(G, -1, -2)
+    K_T = np.swapaxes(K, -1, -2)
+    D_T = np.swapaxes(D, -1, -2)
+    P_WZ = np.swapaxes(P_ZW, -1, -2)
+
+    # Products of the terms G and K
+    P_next = (
+        G @ P_ZW @ G_T
+        - G @ (P_ZW * spread) @ K_T
+        - K @ (P_ZW * spread_T) @ G_T
+        + K @ (P_ZW * spread * spread_T) @ K_T
+    )
+
+    # Products with the term D, where W == X and/or Z == Y
+    u = (P_ZW * D).sum(axis=-1)  # u[Y] = sum_W P[Y, W] D[Y, W]
+    v = (P_ZW * D_T).sum(axis=-2)  # v[X] = sum_Z P[Z, X] D[X, Z]
+    mu = (P_ZW * D * spread_T).sum(
+        axis=-1
+    )  # mu[Y] = sum_W P[Y, W] D[Y, W] spread[W, Y]
+    nu = (P_ZW * D_T * spread).sum(
+        axis=-2
+    )  # nu[X] = sum_Z P[Z, X] D[X, Z] spread[Z, X]
+    P_next += (
+        G * u[..., np.newaxis, :]
+        + v[..., :, np.newaxis] * G_T
+        + P_WZ * D * D_T
+        - K_T * nu[..., :, np.newaxis]
+        - K * mu[..., np.newaxis, :]
+    )
+
+    # For stability, compute prob of last state as 1 - sum prob other states
+    P_next[..., :-1, -1] = p_next[..., :-1] - P_next[..., :-1, :-1].sum(axis=-1)
+    P_next[..., -1, :-1] = P_next[..., :-1, -1]
+    P_next[..., -1, -1] = p_next[..., -1] - P_next[..., -1, :-1].sum(axis=-1)
+
+    return p_next, P_next
+
+
+def variance_neighboring_cell(
+    p: np.ndarray,
+    P: np.ndarray,
+    state: State,
+    num_neighbors: int,
+    variance_order: int | None,
+) -> np.ndarray:
+    """The variance in the number of cells in given state, normalized by dividing by
+    the number of cells, given the probabilities `p[..., X]` of single cells and
+    `P[..., X, Y]` of pairs of neighboring cells.
+
+    The probability of the pattern (state, *, ..., *, state) with `k` cells in the
+    middle is the sum over all middle states of `P[state, U1] P[U1, U2] ... P[Uk, state]
+    / (p[U1] ... p[Uk])`, i.e. `e^T (P diag(1 / p))^k P e` with `e` the unit vector of
+    the state, so each additional term takes a single vector-matrix product. If
+    `variance_order` is `None`, terms are added until they become negligible.
+
+    Leading axes of `p` and `P` are treated as batch axes.
+    """
+    # Probability of any cell being in given state
+    p_state = p[..., state]
+
+    # First order term
+    var = p_state - p_state**2
+
+    # Transfer matrix `P[U, V] / p[U]`, skipping states U that do not occur
+    positive = np.real(p) > 0.0
+    p_inverse = np.where(positive, 1.0 / np.where(positive, p, 1.0), 0.0)
+    transfer = p_inverse[..., :, np.newaxis] * P
+
+    # Higher order terms
+    x = P[..., state, :]  # x[U] = sum over middle states of (state, *, ..., *, U)
+    max_order = MAX_VARIANCE_ORDER if variance_order is None else variance_order
+    for k in range(0, max_order):
+        # Compute probability q of pattern (state, *, ..., *, state)
+        # where pattern consists of k `*` in the middle
+        if k > 0:
+            x = np.einsum("...u,...uv->...v", x, transfer)
+        q = x[..., state]
+
+        # NOTE: This assumes a 2-dimensional topology:
+        # The number of neighbors (k + 1) steps away is (1 + k) * `num_neighbors`
+        term = (1 + k) * num_neighbors * (q - p_state**2)
+        var = var + term
+
+        if variance_order is None and np.all(
+            np.abs(np.real(term)) <= VARIANCE_TOLERANCE * np.abs(np.real(var))
+        ):
+            break
+
+    return var
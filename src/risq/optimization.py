@@ -1,6 +1,10 @@
+import inspect
 from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
 
-from tqdm import tqdm
+from risq.instrumentation import Stats, create_stats, timer
+
+Callback = Callable[[int, float, dict[str, float]], None]
 
 
 def gradient_descent(
@@ -10,33 +14,68 @@ def gradient_descent(
     learning_rate: float = 0.001,
     num_iter: int = 100,
     dx: float = 0.001,
+    exact_gradient: bool = False,
+    num_workers: int | None = None,
+    callback: Callback | None = None,
 ):
+    """Minimizes `loss_function` using gradient descent.
+
+    By default the gradients are approximated with finite differences (with relative
+    step `dx`). If `exact_gradient` is set, `loss_function` should instead return a
+    tuple `(loss, gradients)` with the gradients as a dictionary, such as returned by
+    `risq.sensitivity.compute_loss_and_gradient`.
+
+    If `num_workers` is given, the losses needed for the finite differences are
+    evaluated concurrently in a pool of that many processes. In that case
+    `loss_function` should be picklable (e.g. defined at the top level of a module).
+
+    If `callback` is given, it is called after every iteration with the number of the
+    iteration, the loss before the iteration and the updated values.
+    """
+    from tqdm import tqdm
+
     # Start with the given values
     values = dict(values)
+    executor = _create_executor(num_workers)
+    stats = create_stats("gradient_descent")
     try:
         t = tqdm(range(num_iter))
-        for _ in t:
-            # Keep track of gradients with respect to all values `x`
-            gradients = {x: 0.0 for x in values}
+        for iteration in t:
+            if stats is not None:
+                stats.count("iterations")
+            if exact_gradient:
+                # Compute value and gradients in one pass
+                loss, gradients = _call(loss_function, values, stats)
+                t.set_postfix({"loss": loss, **values})
+            else:
+                # Keep track of gradients with respect to all values `x`
+                gradients = {x: 0.0 for x in values}
 
-            # Compute initial value
-            loss = loss_function(**values)
-            t.set_postfix({"loss": loss, **values})
+                # Compute initial value and perturbed values (possibly concurrently)
+                steps = {x: abs(values[x] * dx) for x in values}
+                candidates = [values] + [
+                    {**values, x: values[x] + eps} for x, eps in steps.items()
+                ]
+                loss, *new_losses = _evaluate(
+                    loss_function, candidates, executor, stats
+                )
+                t.set_postfix({"loss": loss, **values})
 
-            # Compute gradients
-            for x in values:
-                eps = abs(values[x] * dx)
-                new_values = dict(values)
-                new_values[x] += eps
-                new_loss = loss_function(**new_values)
-                gradients[x] += (new_loss - loss) / eps
+                # Compute gradients
+                for (x, eps), new_loss in zip(steps.items(), new_losses):
+                    gradients[x] += (new_loss - loss) / eps
 
             # Apply gradients to values
             for x in values:
                 values[x] -= learning_rate * gradients[x]
 
+            if callback is not None:
+                callback(iteration, loss, dict(values))
+
         # Compute final loss
-        loss = loss_function(**values)
+        loss = _call(loss_function, values, stats)
+        if exact_gradient:
+            loss, _ = loss
         print(f"┌──────────────────────┐")
         print(f"│  TRAINING COMPLETE ! │")
         print(f"│ FINAL LOSS: {loss:.6f} │")
@@ -54,6 +93,10 @@ def gradient_descent(
 
         return values
 
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
 
 def steepest_descent(
     loss_function: Callable,
@@ -61,35 +104,78 @@ def steepest_descent(
     *,
     num_iter: int = 100,
     delta: float = 0.1,
+    num_workers: int | None = None,
+    callback: Callback | None = None,
 ):
+    """Minimizes `loss_function` by repeatedly trying to step each value by `delta`.
+
+    If `num_workers` is given, the candidate steps are evaluated concurrently in a
+    pool of that many processes, giving the same steps as the sequential search. In
+    that case `loss_function` should be picklable (e.g. defined at the top level of
+    a module).
+
+    If `callback` is given, it is called after every iteration with the number of the
+    iteration, the current loss and the current values.
+
+    If `loss_function` has a `cutoff` argument, candidates are evaluated with the
+    current loss as cutoff: as a candidate is only accepted if its loss is below the
+    current loss, `loss_function` may stop early and return any value of at least
+    `cutoff` once it knows the loss is at least `cutoff` (see `incidence_loss`).
+    """
+    from tqdm import tqdm
+
     # Start with the given values
     values = dict(values)
+    executor = _create_executor(num_workers)
+    stats = create_stats("steepest_descent")
+    use_cutoff = _accepts_cutoff(loss_function)
     try:
         # Current loss
-        current_loss = loss_function(**values)
+        current_loss = _call(loss_function, values, stats)
 
         t = tqdm(range(num_iter))
-        for _ in t:
+        for iteration in t:
             t.set_postfix({"loss": current_loss, "delta": delta, **values})
+            if stats is not None:
+                stats.count("iterations")
 
             some_update = False
-            for x in values:
-                for new_value_x in [values[x] - delta, values[x] + delta]:
-                    new_values = dict(values)
-                    new_values[x] = new_value_x
-                    new_current_loss = loss_function(**new_values)
-                    if new_current_loss < current_loss:
-                        values[x] = new_value_x
-                        current_loss = new_current_loss
-                        some_update = True
-                        break
+            if executor is None:
+                for x in values:
+                    for new_value_x in [values[x] - delta, values[x] + delta]:
+                        new_values = dict(values)
+                        new_values[x] = new_value_x
+                        new_current_loss = _call(
+                            loss_function,
+                            new_values,
+                            stats,
+                            cutoff=current_loss if use_cutoff else None,
+                        )
+                        if new_current_loss < current_loss:
+                            values[x] = new_value_x
+                            current_loss = new_current_loss
+                            some_update = True
+                            break
+            else:
+                some_update, current_loss = _steepest_descent_round(
+                    loss_function,
+                    values,
+                    current_loss,
+                    delta,
+                    executor,
+                    stats,
+                    use_cutoff,
+                )
             if not some_update:
                 delta *= 0.5
             else:
                 delta *= 1.1
 
+            if callback is not None:
+                callback(iteration, current_loss, dict(values))
+
         # Compute final loss
-        loss = loss_function(**values)
+        loss = _call(loss_function, values, stats)
         print(f"┌──────────────────────┐")
         print(f"│  TRAINING COMPLETE ! │")
         print(f"│ FINAL LOSS: {loss:.6f} │")
@@ -106,3 +192,116 @@ def steepest_descent(
         print(values)
 
         return values
+
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _accepts_cutoff(loss_function: Callable) -> bool:
+    """Whether `loss_function` has a `cutoff` argument, to stop early."""
+    try:
+        return "cutoff" in inspect.signature(loss_function).parameters
+    except (TypeError, ValueError):  # no signature
+        return False
+
+
+def _create_executor(num_workers: int | None) -> Executor | None:
+    if num_workers is None or num_workers <= 1:
+        return None
+    return ProcessPoolExecutor(num_workers)
+
+
+def _call(
+    loss_function: Callable,
+    values: dict[str, float],
+    stats: Stats | None,
+    cutoff: float | None = None,
+):
+    """Evaluates `loss_function` (passing `cutoff`, if given), counting and timing the
+    evaluation in `stats`."""
+    kwargs = {} if cutoff is None else {"cutoff": cutoff}
+    if stats is None:
+        return loss_function(**values, **kwargs)
+
+    stats.count("loss_evaluations")
+    with stats.timer("loss"):
+        return loss_function(**values, **kwargs)
+
+
+def _evaluate(
+    loss_function: Callable,
+    candidates: list[dict[str, float]],
+    executor: Executor | None,
+    stats: Stats | None = None,
+    cutoff: float | None = None,
+) -> list:
+    """Evaluates `loss_function` for all candidate values, concurrently if possible."""
+    if executor is None:
+        return [
+            _call(loss_function, candidate, stats, cutoff) for candidate in candidates
+        ]
+
+    kwargs = {} if cutoff is None else {"cutoff": cutoff}
+    if stats is not None:
+        stats.count("loss_evaluations", len(candidates))
+    with timer(stats, "loss"):
+        futures = [
+            executor.submit(loss_function, **candidate, **kwargs)
+            for candidate in candidates
+        ]
+        return [future.result() for future in futures]
+
+
+def _steepest_descent_round(
+    loss_function: Callable,
+    values: dict[str, float],
+    current_loss: float,
+    delta: float,
+    executor: Executor,
+    stats: Stats | None = None,
+    use_cutoff: bool = False,
+) -> tuple[bool, float]:
+    """One round of `steepest_descent`, trying all values in order, with the candidates
+    evaluated concurrently. Updates `values` and returns `(some_update, current_loss)`.
+
+    The candidates of all remaining values are evaluated speculatively. Once a step is
+    accepted, the candidates of the values after it are evaluated again (from the
+    updated values), so the result is the same as trying them one at a time.
+    """
+    names = list(values)
+    some_update = False
+
+    i = 0
+    while i < len(names):
+        candidates = [
+            (x, new_value_x)
+            for x in names[i:]
+            for new_value_x in [values[x] - delta, values[x] + delta]
+        ]
+        new_losses = _evaluate(
+            loss_function,
+            [{**values, x: new_value_x} for x, new_value_x in candidates],
+            executor,
+            stats,
+            cutoff=current_loss if use_cutoff else None,
+        )
+
+        accepted = None
+        for j, ((x, new_value_x), new_current_loss) in enumerate(
+            zip(candidates, new_losses)
+        ):
+            if new_current_loss < current_loss:
+                values[x] = new_value_x
+                current_loss = new_current_loss
+                some_update = True
+                accepted = j
+                break
+
+        if accepted is None:
+            break
+
+        # Continue with the values after the accepted one
+        i += accepted // 2 + 1
+
+    return some_update, current_loss
@@ -0,0 +1,93 @@
+from collections.abc import Callable
+
+import numpy as np
+
+from risq.batch import propagate_batch
+
+# `erf` is kept here for models created with complex-step perturbed values
+from risq.method import Method, erf, exceedance_probability
+from risq.model import Model, State
+from risq.neighboring_cell_method import (
+    DEFAULT_VARIANCE_ORDER,
+    variance_neighboring_cell,
+)
+
+COMPLEX_STEP = 1e-20
+
+
+def cancer_probability(
+    mean_per_cell: np.ndarray, variance_per_cell: np.ndarray, num_cells: int
+) -> np.ndarray:
+    """Same as `compute_cancer_probability`, but from the (arrays of) mean and variance
+    per cell. Works for complex-step perturbed values too."""
+    return exceedance_probability(
+        mean_per_cell * num_cells, variance_per_cell * num_cells
+    )
+
+
+def compute_loss_and_gradient(
+    create_model: Callable[..., Model],
+    values: dict[str, float],
+    method: type[Method],
+    *,
+    distribution: list[tuple[int, float]],
+    num_cells: int,
+    state_cancer: State,
+    steps_per_year: int = 12,
+) -> tuple[float, dict[str, float]]:
+    """Computes the loss (total square difference of the probabilities per age bracket)
+    and its exact gradient with respect to `values`, in a single batched pass.
+
+    The gradient is computed with complex-step differentiation: the model is created
+    once per value, with that value perturbed by a tiny imaginary step, and all models
+    are propagated together. This is a form of forward-mode differentiation, and gives
+    the derivatives up to rounding errors (unlike finite differences).
+
+    Args:
+        create_model: Function creating the model from keyword arguments `values`.
+            It should only use operations that work for complex numbers, e.g. use
+            `risq.sensitivity.erf` instead of `math.erf`.
+        values: The values at which to compute the loss and its gradient.
+        method: Either `SingleCellMethod` or `NeighboringCellMethod`.
+        distribution: The fraction of cases per age bracket, as `(age, fraction)`.
+        num_cells: The number of cells.
+        state_cancer: The cancer state.
+        steps_per_year: The number of time steps per year of age, as in
+            `risq.utils.incidence_loss`.
+
+    Returns:
+        A tuple `(loss, gradients)`, where `gradients` maps names of values to
+        the derivative of the loss with respect to that value.
+    """
+    names = list(values)
+    models = []
+    for name in names:
+        perturbed = {x: complex(value) for x, value in values.items()}
+        perturbed[name] += COMPLEX_STEP * 1j
+        models.append(create_model(**perturbed))
+
+    times = [age * steps_per_year for age, _ in distribution]
+    states = propagate_batch(models, method, times)
+
+    # Compute loss as total square difference of probabilities
+    loss = 0.0
+    prev_prob_cdf = 0.0
+    for (_, prob), (p, P) in zip(distribution, states):
+        mean = p[:, state_cancer]
+        if P is None:
+            variance = mean - mean**2
+        else:
+            variance = variance_neighboring_cell(
+                p, P, state_cancer, models[0].num_neighbors, DEFAULT_VARIANCE_ORDER
+            )
+
+        prob_cdf = cancer_probability(mean, variance, num_cells)
+        prob_est = prob_cdf - prev_prob_cdf
+        loss += (prob_est - prob) ** 2
+
+        prev_prob_cdf = prob_cdf
+
+    gradients = {
+        name: float(loss[i].imag / COMPLEX_STEP) for i, name in enumerate(names)
+    }
+    return float(loss[0].real), gradients
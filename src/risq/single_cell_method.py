@@ -1,73 +1,116 @@
-from risq.method import Method
-from risq.model import Model, State
-
+from collections.abc import Sequence
 
-class SingleCellMethod(Method):
+import numpy as np
 
-    def __init__(self, model: Model):
+from risq.cache import PrefixCache, PrefixKeys, ResultCache
+from risq.instrumentation import Stats, create_stats, timer
+from risq.model import Model, State
+from risq.trajectory_method import TrajectoryMethod
+
+
+class SingleCellMethod(TrajectoryMethod):
+
+    TRAJECTORIES = {"trajectory": "trajectory"}
+
+    def __init__(
+        self,
+        model: Model,
+        cache: ResultCache | None = None,
+        prefix_cache: PrefixCache | None = None,
+    ):
+        """
+        Args:
+            model: The cell model.
+            cache: Optional on-disk cache to load and store the trajectory in. Not
+                used for models that are tabulated lazily (see `Model.compile`).
+            prefix_cache: Optional in-memory cache of trajectory prefixes, shared with
+                other methods, to start from the latest time at which the schedule of
+                the model agrees with an earlier evaluation (e.g. the
+                `DEFAULT_PREFIX_CACHE` of `risq.cache`, when fitting a `CombinedModel`
+                whose default model is fixed).
+        """
         self.model = model
-        self.memory = {}
+        self.compiled_model = model.compile()
+        self.trajectory: list[np.ndarray] = []  # probabilities of all states, per time
+        self.cache = None if self.compiled_model.lazy else cache
+        self.prefix_cache = prefix_cache
+        self._prefix_keys: PrefixKeys | None = None
+        self.stats: Stats | None = create_stats("SingleCellMethod")
 
     def name() -> str:
         return "Single cell"
 
     def probability(self, time: int, state: State) -> float:
-        for t in range(0, time, 16):  # (to prevent max recursion exceeded)
-            self.compute_probability(t, state)
         return self.compute_probability(time, state)
 
     def variance(self, time: int, state: State) -> float:
         p = self.probability(time, state)
         return p - p**2
 
-    def compute_probability(self, time: int, state: State) -> float:
-        # Recall result from memory if possible
-        key = (time, state)
-        if key in self.memory:
-            return self.memory[key]
-
-        # Otherwise, compute the probability and store in memory
-        prob = self._compute_probability(time, state)
-        self.memory[key] = prob
-        return prob
+    def moments(
+        self, times: Sequence[int], state: State
+    ) -> tuple[np.ndarray, np.ndarray]:
+        self.advance(max(times, default=0))
+        p = np.array([self.trajectory[time][state] for time in times])
+        return p, p - p**2
 
-    def _compute_probability(self, time: int, state: State) -> float:
-        X = state
+    def compute_probability(self, time: int, state: State) -> float:
+        self.advance(time)
+        return float(self.trajectory[time][state])
 
+    def advance(self, time: int):
+        """Computes the probabilities of all states for all times up to given time."""
         # Base case: at time 0 all cells are healthy
-        if time == 0:
-            return self.model.prob_initial((X,))
-
-        # For stability reasons: compute prob of last state as 1 - sum prob other states
-        if X == self.model.states[-1]:
-            return 1.0 - sum(
-                self.compute_probability(time, U) for U in self.model.states[:-1]
-            )
-
-        p = 0.0
-        for Y in self.model.states:
-            # Probability that cell was in state Y previous time step
-            p_Y = self.compute_probability(time - 1, Y)
-
-            if p_Y == 0.0:
-                continue
-
-            # Probability that Y is overgrown by some neighboring X
-            p_X = self.compute_probability(time - 1, X)
-            p_X_overgrows_Y = self.model.prob_spread(time, X, Y)
-            p_Y_overgrown_by_some_X = (
-                1.0 - (1.0 - p_X * p_X_overgrows_Y) ** self.model.num_neighbors
+        if not self.trajectory:
+            self.trajectory.append(
+                np.array([self.model.prob_initial((X,)) for X in self.model.states])
             )
-            p += p_Y * p_Y_overgrown_by_some_X
-
-            # When Y is not overgrown by any neighbor, look at the internal probabilities
-            p_X_from_Y = self.model.prob_internal(time, X, Y)
-            p_Y_not_overgrown = 0.0  # i.e. by a single neighbor
-            for Z in self.model.states:
-                p_Z = self.compute_probability(time - 1, Z)
-                p_Z_overgrows_Y = self.model.prob_spread(time, Z, Y)
-                p_Y_not_overgrown += p_Z * (1.0 - p_Z_overgrows_Y)
-            p_Y_not_overgrown_at_all = p_Y_not_overgrown**self.model.num_neighbors
-            p += p_Y * p_Y_not_overgrown_at_all * p_X_from_Y
-
-        return p
+            if self.cache is not None:
+                self._load_from_cache()
+
+        if len(self.trajectory) > time:
+            return
+
+        with timer(self.stats, "advance"):
+            if self.prefix_cache is not None:
+                self._load_prefix(time)
+            start = len(self.trajectory)
+
+            while len(self.trajectory) <= time:
+                t = len(self.trajectory)
+                internal, spread = self.compiled_model.tables(t)
+                self.trajectory.append(
+                    step_single_cell(
+                        self.trajectory[-1], internal, spread, self.model.num_neighbors
+                    )
+                )
+                if self.stats is not None:
+                    self.stats.step(self, t)
+
+            if self.prefix_cache is not None:
+                self._store_prefixes(start, time)
+            if self.cache is not None:
+                self._store_in_cache()
+
+
+def step_single_cell(
+    p: np.ndarray, internal: np.ndarray, spread: np.ndarray, num_neighbors: int
+) -> np.ndarray:
+    """Advances the probabilities `p[..., Y]` that a cell is in state `Y` one time step.
+
+    Leading axes of `p`, `internal` and `spread` are treated as batch axes.
+    """
+    # Probability that Y is overgrown by some neighboring X
+    p_X_overgrows_Y = p[..., :, np.newaxis] * spread
+    p_Y_overgrown_by_some_X = 1.0 - (1.0 - p_X_overgrows_Y) ** num_neighbors
+
+    # When Y is not overgrown by any neighbor, look at the internal probabilities
+    p_Y_not_overgrown = np.einsum("...z,...zy->...y", p, 1.0 - spread)
+    p_Y_not_overgrown_at_all = p_Y_not_overgrown**num_neighbors
+    p_X_from_Y = p_Y_not_overgrown_at_all[..., np.newaxis, :] * internal
+
+    p_next = np.einsum("...xy,...y->...x", p_Y_overgrown_by_some_X + p_X_from_Y, p)
+
+    # For stability reasons: compute prob of last state as 1 - sum prob other states
+    p_next[..., -1] = 1.0 - p_next[..., :-1].sum(axis=-1)
+    return p_next
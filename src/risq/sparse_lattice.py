@@ -0,0 +1,207 @@
+import numpy as np
+from numpy.random import RandomState
+
+from risq.lattice import step_cells
+from risq.statistics import RunningStatistics
+
+
+class SparseLattice:
+
+    def __init__(
+        self, height: int, width: int, indices: np.ndarray, states: np.ndarray
+    ):
+        """A periodic lattice where only the cells that are not in state 0 are stored.
+
+        Args:
+            height: The height of the lattice.
+            width: The width of the lattice.
+            indices: The (sorted) flat indices `y * width + x` of the cells that are not
+                in state 0.
+            states: The states of these cells.
+        """
+        self.height = height
+        self.width = width
+        self.indices = indices
+        self.states = states
+
+    @property
+    def num_cells(self) -> int:
+        return self.height * self.width
+
+    @classmethod
+    def from_dense(cls, cells: np.ndarray) -> "SparseLattice":
+        height, width = cells.shape
+        indices = np.flatnonzero(cells)
+        return cls(height, width, indices, cells.ravel()[indices].astype(np.uint8))
+
+    def to_dense(self) -> np.ndarray:
+        cells = np.zeros(self.num_cells, dtype=np.uint8)
+        cells[self.indices] = self.states
+        return cells.reshape(self.height, self.width)
+
+    def lookup(self, indices: np.ndarray) -> np.ndarray:
+        """The states of the cells with given flat indices."""
+        if len(self.indices) == 0:
+            return np.zeros(indices.shape, dtype=np.uint8)
+
+        positions = np.searchsorted(self.indices, indices)
+        positions = np.minimum(positions, len(self.indices) - 1)
+        found = self.indices[positions] == indices
+        return np.where(found, self.states[positions], 0).astype(np.uint8)
+
+    def neighbors(self, indices: np.ndarray) -> np.ndarray:
+        """The flat indices of the four neighbors of the cells with given flat indices,
+        as an array of shape `(4, *indices.shape)` (with periodic boundary conditions),
+        in the same order as `step_lattice`."""
+        y, x = np.divmod(indices, self.width)
+        return np.stack(
+            [
+                y * self.width + (x + 1) % self.width,  # (x + 1, y)
+                y * self.width + (x - 1) % self.width,  # (x - 1, y)
+                (y + 1) % self.height * self.width + x,  # (x, y + 1)
+                (y - 1) % self.height * self.width + x,  # (x, y - 1)
+            ]
+        )
+
+    def count_states(self, num_states: int) -> np.ndarray:
+        counts = np.bincount(self.states, minlength=num_states)
+        counts[0] += self.num_cells - len(self.indices)
+        return counts
+
+
+def step_sparse_lattice(
+    lattice: SparseLattice,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    random_state: RandomState,
+) -> SparseLattice:
+    """Advances a sparse lattice one time step, following the same rules as
+    `step_lattice` (but drawing different random numbers).
+
+    Cells in state 0 whose neighbors are all in state 0 (quiet cells) are not updated
+    one by one: they all leave state 0 with the same probability, so the number of
+    quiet cells leaving state 0 is drawn from a binomial distribution, and that many
+    quiet cells are picked uniformly at random. Only the cells that are not in
+    state 0 and their neighbors are updated explicitly, so the time and memory used
+    grow with the number of cells that are not in state 0, not with the lattice area.
+    """
+    # Cells that are not quiet: all stored cells and their neighbors
+    active = np.unique(
+        np.concatenate([lattice.indices, lattice.neighbors(lattice.indices).ravel()])
+    )
+    new_states = step_cells(
+        lattice.lookup(active),
+        lattice.lookup(lattice.neighbors(active)),
+        spread,
+        internal_targets,
+        cumulative_internal,
+        random_state,
+    )
+
+    # Quiet cells are overgrown by their neighbors (which are in state 0) or go to
+    # another state internally, with probabilities `targets_0[k]`
+    targets_0 = internal_targets[0]
+    probs_0 = np.diff(cumulative_internal[0], prepend=0.0)
+    probs_0[targets_0 == 0] = 0.0
+    prob_leave = (1.0 - spread[0, 0]) ** 4 * probs_0.sum()
+
+    leave = np.zeros(0, dtype=np.int64)
+    leave_states = np.zeros(0, dtype=np.uint8)
+    if prob_leave > 0.0:
+        num_quiet = lattice.num_cells - len(active)
+        num_leave = random_state.binomial(num_quiet, min(prob_leave, 1.0))
+        leave = _sample_excluding(lattice.num_cells, num_leave, active, random_state)
+        choices = random_state.choice(
+            len(targets_0), size=num_leave, p=probs_0 / probs_0.sum()
+        )
+        leave_states = targets_0[choices]
+
+    # Only keep the cells that are not in state 0
+    indices = np.concatenate([active[new_states != 0], leave])
+    states = np.concatenate([new_states[new_states != 0], leave_states])
+    order = np.argsort(indices)
+    return SparseLattice(
+        lattice.height, lattice.width, indices[order], states[order].astype(np.uint8)
+    )
+
+
+def _sample_excluding(
+    n: int, k: int, excluded: np.ndarray, random_state: RandomState
+) -> np.ndarray:
+    """Picks `k` distinct integers uniformly at random from `0, ..., n - 1`, except the
+    (sorted) integers `excluded`, by rejection. Assumes `k <= n - len(excluded)`.
+
+    When more than half of the remaining integers are picked, rejection rarely hits
+    the few that are left, so they are then listed and picked from explicitly."""
+    if 2 * k > n - len(excluded):
+        remaining = np.setdiff1d(np.arange(n), excluded, assume_unique=True)
+        return random_state.choice(remaining, size=k, replace=False)
+
+    samples = np.zeros(0, dtype=np.int64)
+    while len(samples) < k:
+        # Draw a batch of candidates, and keep the first occurrence of new ones
+        candidates = random_state.randint(0, n, size=2 * (k - len(samples)) + 16)
+        if len(excluded) > 0:
+            positions = np.searchsorted(excluded, candidates)
+            positions = np.minimum(positions, len(excluded) - 1)
+            candidates = candidates[excluded[positions] != candidates]
+        candidates = np.concatenate([samples, candidates])
+        _, first = np.unique(candidates, return_index=True)
+        samples = candidates[np.sort(first)]
+    return samples[:k]
+
+
+def simulate_trials_sparse(
+    num_trials: int,
+    height: int,
+    width: int,
+    spread: np.ndarray,
+    internal_targets: np.ndarray,
+    cumulative_internal: np.ndarray,
+    random_state: RandomState,
+    *,
+    initial_cells: np.ndarray | None = None,
+    keep_cells: bool = False,
+    progress: bool = True,
+) -> tuple[RunningStatistics, np.ndarray, np.ndarray | None]:
+    """Same as `simulate_trials`, but stores only the cells that are not in state 0,
+    see `step_sparse_lattice`. Trials are simulated one at a time."""
+    from tqdm import tqdm
+
+    time_steps, num_states, _ = spread.shape
+
+    statistics = RunningStatistics((time_steps, num_states))
+    final_counts = np.zeros((num_trials, num_states), dtype=np.int32)
+    final_cells = (
+        np.zeros((num_trials, height, width), dtype=np.uint8) if keep_cells else None
+    )
+
+    for trial in tqdm(range(num_trials), leave=False, disable=not progress):
+        # Start trial with cells all in state 0, unless given otherwise
+        if initial_cells is None:
+            lattice = SparseLattice(
+                height, width, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+            )
+        else:
+            lattice = SparseLattice.from_dense(initial_cells[trial])
+        counts = np.zeros((time_steps, num_states), dtype=np.int32)
+        final_counts[trial] = lattice.count_states(num_states)
+
+        for t in range(time_steps):
+            lattice = step_sparse_lattice(
+                lattice,
+                spread[t],
+                internal_targets,
+                cumulative_internal[t],
+                random_state,
+            )
+            counts[t] = lattice.count_states(num_states)
+
+        statistics.update(counts[np.newaxis])
+        if time_steps > 0:
+            final_counts[trial] = counts[-1]
+        if keep_cells:
+            final_cells[trial] = lattice.to_dense()
+
+    return statistics, final_counts, final_cells
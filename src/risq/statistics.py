@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class RunningStatistics:
+    """Running (elementwise) mean and variance of arrays of a fixed shape.
+
+    Samples are added in batches, and batches are combined with the parallel
+    version of Welford's algorithm (Chan et al.). This avoids the loss of precision
+    of computing the variance as E[X^2] - E[X]^2 when the values are large.
+    """
+
+    def __init__(self, shape: tuple[int, ...]):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)  # sum of squared deviations
+
+    @property
+    def variance(self) -> np.ndarray:
+        """The (population) variance of all samples added so far."""
+        return self.m2 / self.count
+
+    def update(self, samples: np.ndarray):
+        """Adds a batch of samples, an array of shape `(num_samples, *shape)`."""
+        num_samples = samples.shape[0]
+        if num_samples == 0:
+            return
+
+        mean = samples.mean(axis=0)
+        m2 = ((samples - mean) ** 2).sum(axis=0)
+        self._combine(num_samples, mean, m2)
+
+    def merge(self, other: "RunningStatistics"):
+        """Adds all samples of `other`."""
+        if other.count == 0:
+            return
+
+        self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count: int, mean: np.ndarray, m2: np.ndarray):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * (count / total)
+        self.m2 += m2 + delta**2 * (self.count * count / total)
+        self.count = total
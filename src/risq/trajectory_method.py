@@ -0,0 +1,110 @@
+import numpy as np
+
+from risq.cache import (
+    PrefixCache,
+    PrefixKeys,
+    ResultCache,
+    load_trajectories,
+    model_key,
+    store_trajectories,
+)
+from risq.compiled_model import CompiledModel
+from risq.instrumentation import Stats
+from risq.method import Method
+from risq.model import Model
+
+
+class TrajectoryMethod(Method):
+    """Base class of the methods that propagate probabilities forward in time, storing
+    them per time in one or more trajectories (lists of arrays indexed by time).
+
+    Handles loading and storing the trajectories in the on-disk `cache` and in the
+    in-memory `prefix_cache`. Subclasses set `TRAJECTORIES`, which maps the name of
+    every trajectory in the cache to the attribute holding it.
+    """
+
+    TRAJECTORIES: dict[str, str] = {}
+
+    _stored_length = 0  # the number of times last loaded from or stored in the cache
+
+    model: Model
+    compiled_model: CompiledModel
+    cache: ResultCache | None
+    prefix_cache: PrefixCache | None
+    stats: Stats | None
+    _prefix_keys: PrefixKeys | None
+
+    def _trajectories(self) -> list[list[np.ndarray]]:
+        return [getattr(self, attribute) for attribute in self.TRAJECTORIES.values()]
+
+    def _set_trajectories(self, trajectories):
+        for attribute, trajectory in zip(self.TRAJECTORIES.values(), trajectories):
+            setattr(self, attribute, list(trajectory))
+
+    def _load_prefix(self, time: int):
+        if self._prefix_keys is None:
+            self._prefix_keys = PrefixKeys(
+                self.compiled_model,
+                self.__class__.__name__,
+                self.model.num_neighbors,
+                *(trajectory[0] for trajectory in self._trajectories()),
+            )
+
+        keys = self._prefix_keys.until(time)[: time + 1]
+        cached = self.prefix_cache.load(keys, len(self._trajectories()[0]))
+        if self.stats is not None:
+            hit = cached is not None
+            self.stats.count("prefix_cache.hits" if hit else "prefix_cache.misses")
+        if cached is not None:
+            _, trajectories = cached
+            self._set_trajectories(trajectories)
+
+    def _store_prefixes(self, start: int, time: int):
+        # Store at every switch of the schedule, and at the end
+        keys = self._prefix_keys.until(time)
+        for t in range(start, time + 1):
+            if t == time or self._prefix_keys.is_boundary(t):
+                self.prefix_cache.store(
+                    keys[t],
+                    tuple(
+                        tuple(trajectory[: t + 1])
+                        for trajectory in self._trajectories()
+                    ),
+                )
+
+    def _cache_key(self) -> str:
+        return self.cache.key(
+            self.__class__.__name__,
+            *model_key(self.compiled_model, self.model.num_neighbors),
+            *(trajectory[0] for trajectory in self._trajectories()),
+        )
+
+    def _load_from_cache(self):
+        arrays = load_trajectories(self.cache, self._cache_key(), self.compiled_model)
+        if self.stats is not None:
+            hit = arrays is not None
+            self.stats.count("cache.hits" if hit else "cache.misses")
+        if arrays is not None:
+            self._set_trajectories(arrays[name] for name in self.TRAJECTORIES)
+            self._stored_length = len(self._trajectories()[0])
+
+    def _store_in_cache(self):
+        """Stores the trajectories in the cache, if they at least doubled in length since
+        they were last loaded or stored. Storing rewrites the whole entry, so this
+        bounds the total size written while advancing step by step (e.g. probing one
+        age at a time) to a few times the size of the final trajectories, at the cost
+        of storing only the first half of them in the worst case."""
+        length = len(self._trajectories()[0])
+        if length < 2 * self._stored_length:
+            return
+
+        self._stored_length = length
+        store_trajectories(
+            self.cache,
+            self._cache_key(),
+            self.compiled_model,
+            {
+                name: np.array(trajectory)
+                for name, trajectory in zip(self.TRAJECTORIES, self._trajectories())
+            },
+        )